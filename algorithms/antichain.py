@@ -0,0 +1,137 @@
+"""
+A family of sets of features where no set is a subset of another, e.g. iiss and relevant features of dominating
+policies. Only the minimal sets are kept when sets are added, and the family stays minimal when a feature is covered
+or removed, so the set cover structures are updated incrementally after each query.
+"""
+from algorithms.featureSet import FeatureSet
+
+
+class Antichain:
+  """
+  Sets are FeatureSets, bucketed by their sizes and indexed by the features they contain.
+  A new set is rejected if it's a superset of a kept set (only the sets that share its features are checked),
+  and the kept sets that are supersets of it are dropped (only the sets that contain its features are checked).
+  The index also gives the number of sets that contain a feature in O(1).
+
+  Sets are iterated from the smallest to the largest, then by their masks.
+  """
+  def __init__(self, sets=()):
+    # size -> {set}
+    self.buckets = {}
+    # feat -> {set that contains feat}
+    self.containing = {}
+    # the sorted sets, reset when the sets change
+    self.sortedSets = None
+
+    for s in sorted(map(FeatureSet.of, sets), key=lambda _: (len(_), _)):
+      self.add(s)
+
+  def copy(self):
+    other = Antichain()
+    other.buckets = {size: set(bucket) for size, bucket in self.buckets.items()}
+    other.containing = {feat: set(sets) for feat, sets in self.containing.items()}
+    other.sortedSets = self.sortedSets
+    return other
+
+  def hasSubsetOf(self, s):
+    """
+    :return: True if some set in the antichain is a subset of s (including s itself)
+    """
+    if 0 in self.buckets:
+      # the empty set is a subset of any set, but it's not in the index
+      return True
+
+    # t is a subset of s iff all features of t are in s, i.e. t is found in containing[feat] for len(t) features of s
+    counts = {}
+    for feat in s:
+      for t in self.containing.get(feat, ()):
+        counts[t] = counts.get(t, 0) + 1
+        if counts[t] == len(t): return True
+    return False
+
+  def supersetsOf(self, s):
+    """
+    :return: the sets in the antichain that are supersets of s
+    """
+    if s == 0:
+      return list(self.toList())
+    else:
+      # supersets of s contain all its features, so only check the sets that contain its least common feature
+      candidates = min((self.containing.get(feat, ()) for feat in s), key=len)
+      return [t for t in candidates if s & ~t == 0]
+
+  def add(self, s):
+    """
+    Add s if no set in the antichain is its subset, and drop the sets that are its supersets.
+
+    :return: True if s is added
+    """
+    s = FeatureSet.of(s)
+    if self.hasSubsetOf(s): return False
+
+    for t in self.supersetsOf(s):
+      self.discard(t)
+
+    self.insert(s)
+    return True
+
+  def insert(self, s):
+    """
+    Add s without checking, when s is known to be neither a subset nor a superset of any set in the antichain.
+    """
+    self.buckets.setdefault(len(s), set()).add(s)
+    for feat in s:
+      self.containing.setdefault(feat, set()).add(s)
+    self.sortedSets = None
+
+  def discard(self, s):
+    bucket = self.buckets.get(len(s))
+    if bucket is None or s not in bucket: return
+
+    bucket.remove(s)
+    if len(bucket) == 0: del self.buckets[len(s)]
+    for feat in s:
+      self.containing[feat].remove(s)
+      if len(self.containing[feat]) == 0: del self.containing[feat]
+    self.sortedSets = None
+
+  def coverFeat(self, feat):
+    """
+    Drop the sets that contain feat.
+    """
+    for s in list(self.containing.get(feat, ())):
+      self.discard(s)
+
+  def removeFeat(self, feat):
+    """
+    Remove feat from the sets that contain it, which may make them supersets of or subsets of other sets.
+    """
+    sets = list(self.containing.get(feat, ()))
+    for s in sets:
+      self.discard(s)
+    for s in sorted((s.remove(feat) for s in sets), key=lambda _: (len(_), _)):
+      self.add(s)
+
+  def numOfSetsContainFeat(self, feat):
+    return len(self.containing.get(feat, ()))
+
+  def __len__(self):
+    return sum(len(bucket) for bucket in self.buckets.values())
+
+  def toList(self):
+    if self.sortedSets is None:
+      self.sortedSets = [s for size in sorted(self.buckets) for s in sorted(self.buckets[size])]
+    return self.sortedSets
+
+  def __iter__(self):
+    return iter(self.toList())
+
+  def __getitem__(self, idx):
+    return self.toList()[idx]
+
+  def __contains__(self, s):
+    s = FeatureSet.of(s)
+    return s in self.buckets.get(len(s), ())
+
+  def __repr__(self):
+    return 'Antichain(%s)' % [list(s) for s in self]
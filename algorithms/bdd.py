@@ -0,0 +1,111 @@
+"""
+Reduced ordered binary decision diagrams of monotone DNFs over features.
+A safe policy exists iff all relevant features of some dominating policy are free, which is the DNF
+OR_{feats in domPiFeats} AND_{feat in feats} (feat is free).
+Once it's compiled, its probability under any independent probabilities of features being free is computed in time
+linear in the size of the diagram, and a response to a query restricts the diagram.
+"""
+from functools import reduce
+
+from algorithms.featureSet import FeatureSet
+
+FALSE = 0
+TRUE = 1
+
+
+class BDD:
+  """
+  Nodes are indices of self.nodes. A node (feat, low, high) is the function when feat is locked (low) or free (high).
+  Nodes are unique, and no node has the same low and high children, so the diagram is reduced.
+  Features closer to the root are the ones that appear in more terms.
+  """
+  def __init__(self, terms):
+    """
+    :param terms: sets of features, the DNF is true if all features in some set are free
+    """
+    terms = list(map(FeatureSet.of, terms))
+
+    counts = {}
+    for term in terms:
+      for feat in term:
+        counts[feat] = counts.get(feat, 0) + 1
+    self.order = sorted(counts, key=lambda feat: (-counts[feat], feat))
+    self.level = {feat: idx for idx, feat in enumerate(self.order)}
+
+    # the two terminals, then (feat, low, high) of internal nodes
+    self.nodes = [None, None]
+    self.unique = {}
+
+    compiled = {}
+    self.root = self.compile(frozenset(terms), compiled)
+
+  def makeNode(self, feat, low, high):
+    if low == high: return low
+
+    key = (feat, low, high)
+    if key not in self.unique:
+      self.unique[key] = len(self.nodes)
+      self.nodes.append(key)
+    return self.unique[key]
+
+  def compile(self, terms, compiled):
+    """
+    Shannon expansion on the first feature in self.order that appears in terms.
+
+    :param compiled: terms -> node, memoized for the sub-DNFs that are reached in different ways
+    """
+    if FeatureSet(0) in terms: return TRUE
+    if len(terms) == 0: return FALSE
+    if terms in compiled: return compiled[terms]
+
+    feat = min(reduce(lambda x, y: x | y, terms), key=self.level.get)
+    high = self.compile(frozenset(term.remove(feat) for term in terms), compiled)
+    low = self.compile(frozenset(term for term in terms if feat not in term), compiled)
+
+    node = self.makeNode(feat, low, high)
+    compiled[terms] = node
+    return node
+
+  def restrict(self, feat, free):
+    """
+    Condition on the response to feat, i.e. whether feat is free.
+    """
+    if feat not in self.level: return
+
+    restricted = {}
+
+    def restrictNode(node):
+      if node in (FALSE, TRUE): return node
+      if node in restricted: return restricted[node]
+
+      (nodeFeat, low, high) = self.nodes[node]
+      if self.level[nodeFeat] > self.level[feat]:
+        # feat only appears above this node
+        result = node
+      elif nodeFeat == feat:
+        result = high if free else low
+      else:
+        result = self.makeNode(nodeFeat, restrictNode(low), restrictNode(high))
+
+      restricted[node] = result
+      return result
+
+    self.root = restrictNode(self.root)
+
+  def probability(self, probOfFree):
+    """
+    The weighted model count.
+
+    :param probOfFree: feat -> the probability that feat is free
+    :return: the probability that the DNF is true
+    """
+    probs = {FALSE: 0, TRUE: 1}
+
+    def probOfNode(node):
+      if node not in probs:
+        (feat, low, high) = self.nodes[node]
+        p = probOfFree(feat)
+        probs[node] = p * probOfNode(high) + (1 - p) * probOfNode(low)
+      return probs[node]
+
+    return probOfNode(self.root)
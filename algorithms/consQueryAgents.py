@@ -1,7 +1,19 @@
+from __future__ import print_function
+
 import time
+from functools import reduce
 from operator import mul
 
-from lp import lpDualGurobi, computeValue, lpDualCPLEX
+import numpy
+from scipy import sparse
+
+from domains.domainConstructors import StateConstraints
+from algorithms.dynamicProgramming import constrainedPolicyIteration, safePolicyExists
+from algorithms.featureSet import FeatureSet
+from algorithms.lp import computePolicyValue, lpDualCPLEX, getLPSession, compileMDP
+from algorithms.occupancy import Occupancy
+from algorithms.shortestPath import isShortestPathProblem, shortestPathOptPi
+from algorithms.subsetLattice import SubsetFrontier, PruningRules
 from util import powerset, printOccSA
 import config
 
@@ -24,8 +36,10 @@ class ConsQueryAgent():
     self.mdp = mdp
 
     # indices of constraints
+    if not isinstance(consStates, StateConstraints):
+      consStates = StateConstraints.fromLists(mdp.S, consStates)
     self.consStates = consStates
-    self.consIndices = range(len(consStates))
+    self.consIndices = list(range(len(consStates)))
 
     self.consProbs = consProbs
     self.adversarial = (consProbs is None)
@@ -36,13 +50,16 @@ class ConsQueryAgent():
     self.knownFreeCons = list(knownFreeCons)
     self.unknownCons = list(set(self.consIndices) - set(self.knownLockedCons) - set(self.knownFreeCons))
 
+    # indices of states in consStates and the incidence matrix, see getConsStateIndices
+    self.consStateIndices = None
+    self.consIncidence = None
+    self.consStateIndicesOf = None
+
   def initialSafePolicyExists(self):
     """
-    Run the LP solver with all constraints and see if the LP problem is feasible.
+    See if the LP problem with all constraints is feasible.
     """
-    statusObj = self.findConstrainedOptPi(self.unknownCons)
-
-    return statusObj['feasible']
+    return self.constrainedPolicyExists(self.unknownCons)
 
   def updateFeats(self, newFreeCon=None, newLockedCon=None):
     """
@@ -79,14 +96,45 @@ class ConsQueryAgent():
       activeCons = tuple(activeCons) + tuple(self.knownLockedCons)
     zeroConstraints = self.getGivenFeatCons(activeCons)
 
-    if config.OPT_METHOD == 'gurobi':
-      return lpDualGurobi(mdp, zeroConstraints=zeroConstraints, positiveConstraints=self.goalCons)
+    if config.USE_DP and len(self.goalCons) == 0 and mdp.gamma < 1:
+      # only states to avoid, solve the mdp by dynamic programming
+      compileMDP(mdp)
+      if isShortestPathProblem(mdp):
+        # or simply find the closest reward if the robot stops once rewarded
+        return shortestPathOptPi(mdp, zeroConstraints=zeroConstraints)
+      else:
+        return constrainedPolicyIteration(mdp, zeroConstraints=zeroConstraints)
+    elif config.OPT_METHOD in ['gurobi', 'highs']:
+      # the lp session is shared by mdps with the same structure, e.g. copies of self.mdp
+      return getLPSession(mdp).solve(mdp, zeroConstraints=zeroConstraints, positiveConstraints=self.goalCons)
     elif config.OPT_METHOD == 'cplex':
       # not using this. only for comparision
       return lpDualCPLEX(mdp, zeroConstraints=zeroConstraints, positiveConstraints=self.goalCons)
     else:
       raise Exception('unknown method')
 
+  def constrainedPolicyExists(self, activeCons=(), addKnownLockedCons=True):
+    """
+    :return: whether findConstrainedOptPi(activeCons, addKnownLockedCons) is feasible.
+
+    Goal constraints only ask for nonnegative occupancies, so feasibility only depends on the states to avoid.
+    When gamma < 1, it's checked on the transition graph without solving the lp.
+    """
+    if self.mdp.gamma >= 1:
+      return self.findConstrainedOptPi(activeCons, addKnownLockedCons)['feasible']
+
+    if addKnownLockedCons:
+      activeCons = tuple(activeCons) + tuple(self.knownLockedCons)
+
+    compileMDP(self.mdp)
+    consStateIndices = self.getConsStateIndices(self.mdp.sIndex)
+
+    forbidden = numpy.zeros(len(self.mdp.S), dtype=bool)
+    for idx in activeCons:
+      forbidden[consStateIndices[idx]] = True
+
+    return safePolicyExists(self.mdp, forbidden)
+
   """
   Useful wrapper functions for the one above.
   """
@@ -115,13 +163,15 @@ class ConsQueryAgent():
 
     earlyStop: stop within this time and return whatever dompis found
     """
-    beta = [] # rules to keep
+    beta = PruningRules() # rules to keep
     dominatingPolicies = {}
     dominatingPiValues = {}
+    # activeCons -> mask of constraints violated by its dominating policy
+    dominatingPiViolated = {}
 
     allCons = set()
-    allConsPowerset = set(powerset(allCons))
-    subsetsConsidered = []
+    # subsets of allCons to consider, from the smallest ones
+    frontier = SubsetFrontier()
 
     if config.earlyStop is None:
       # never stop before finding all dom pis
@@ -132,23 +182,16 @@ class ConsQueryAgent():
 
     # iterate until no more dominating policies are found
     while not terminateCond():
-      subsetsToConsider = allConsPowerset.difference(subsetsConsidered)
-
-      if len(subsetsToConsider) == 0: break
-
-      # find the subset with the smallest size
-      activeCons = min(subsetsToConsider, key=lambda _: len(_))
-      if config.DEBUG: print 'activeCons', activeCons
-      subsetsConsidered.append(activeCons)
-
-      skipThisCons = False
-      for enf, relax in beta:
-        if enf.issubset(activeCons) and len(relax.intersection(activeCons)) == 0:
-          # this subset can be ignored
-          skipThisCons = True
-          if config.DEBUG: print 'dominated'
-          break
-      if skipThisCons:
+      activeMask = frontier.pop()
+
+      if activeMask is None: break
+
+      activeCons = tuple(activeMask)
+      if config.DEBUG: print('activeCons', activeCons)
+
+      if beta.prunes(activeMask):
+        # this subset can be ignored
+        if config.DEBUG: print('dominated')
         continue
 
       # it will enforce activeCons and known locked features (inside)
@@ -157,32 +200,35 @@ class ConsQueryAgent():
         x = sol['pi']
         # check violated constraints
         violatedCons = self.findViolatedConstraints(x)
+        violatedMask = FeatureSet.of(violatedCons)
 
         # if an old dominating policy violates more constraints than the current one, but not have as high value as the current one
         # then remove that old dominating policy
-        for oldCons, oldViolated in beta:
-          oldCons = tuple(oldCons)
-          if oldCons in dominatingPiValues.keys() and set(violatedCons).issubset(oldViolated) and dominatingPiValues[oldCons] <= sol['obj']:
+        for oldCons in list(dominatingPiValues.keys()):
+          if violatedMask & ~dominatingPiViolated[oldCons] == 0 and dominatingPiValues[oldCons] <= sol['obj']:
             # the dom pi under cons is dominated by the current pi
             dominatingPolicies.pop(oldCons)
             dominatingPiValues.pop(oldCons)
 
         dominatingPolicies[activeCons] = x
         dominatingPiValues[activeCons] = sol['obj']
+        dominatingPiViolated[activeCons] = violatedMask
 
-        if config.DEBUG: print 'this policy violates', violatedCons
+        if config.DEBUG: print('this policy violates', violatedCons)
       else:
         # infeasible
         violatedCons = ()
-        
-        if config.DEBUG: print 'infeasible'
+        violatedMask = FeatureSet(0)
 
-      # beta records that we would not enforce activeCons and relax occupiedFeats in the future
-      beta.append((set(activeCons), set(violatedCons)))
+        if config.DEBUG: print('infeasible')
 
-      allCons.update(violatedCons)
+      # beta records that we would not enforce activeCons and relax occupiedFeats in the future
+      beta.add(activeMask, violatedMask)
 
-      allConsPowerset = set(powerset(allCons))
+      for con in violatedCons:
+        if con not in allCons:
+          allCons.add(con)
+          frontier.addFeat(con)
 
     domPis = []
     for pi in dominatingPolicies.values():
@@ -190,36 +236,82 @@ class ConsQueryAgent():
 
     # make sure returned values are lists
     allCons = list(allCons)
-    if config.DEBUG: print 'rel cons', allCons, 'num of domPis', len(domPis)
+    if config.DEBUG: print('rel cons', allCons, 'num of domPis', len(domPis))
     return allCons, domPis
 
   def computeValue(self, x):
     """
     compute the value of policy x. it computes the dot product between x and r
     """
-    return computeValue(x, self.mdp.r, self.mdp.S, self.mdp.A)
+    return computePolicyValue(x, self.mdp)
 
   def piSatisfiesCons(self, x, cons):
     violatedCons = self.findViolatedConstraints(x)
     return set(cons).isdisjoint(set(violatedCons))
 
+  def getConsStateIndices(self, sIndex):
+    """
+    :return: [array of indices of states in consStates[idx] for all idx], where states are indexed by sIndex
+    """
+    if self.consStateIndicesOf is not sIndex:
+      cons = self.consStates
+
+      # sIndex may index states differently from consStates.S (e.g. a sink is added), so map the states in constraints
+      positions = numpy.zeros(len(cons.S), dtype=int)
+      statesInCons = numpy.unique(cons.incidence.indices)
+      positions[statesInCons] = [sIndex[cons.S[sIdx]] for sIdx in statesInCons]
+
+      self.consStateIndices = [positions[cons.stateIndices(idx)] for idx in range(len(cons))]
+      self.consIncidence = sparse.csr_matrix((cons.incidence.data, positions[cons.incidence.indices],
+                                              cons.incidence.indptr), shape=(len(cons), len(sIndex)))
+      self.consStateIndicesOf = sIndex
+    return self.consStateIndices
+
+  def getConsIncidence(self, sIndex):
+    """
+    :return: a sparse matrix, where [idx, s] is True if the state indexed by s in sIndex is in consStates[idx]
+    """
+    self.getConsStateIndices(sIndex)
+    return self.consIncidence
+
   def findViolatedConstraints(self, x):
     """
     only return the indices of unknown features that are changed by policy (w/ occupancy x)
     """
-    var = []
+    violated = self.findViolatedConstraintsOfPolicies([x])[0]
+    return [idx for idx in self.unknownCons if violated[idx]]
+
+  def findViolatedConstraintsOfPolicies(self, pis, tolerance=None):
+    """
+    findViolatedConstraints for a batch of policies.
+
+    :param pis: occupancies of policies on the same mdp
+    :param tolerance: a state is visited if its occupancy is larger than this, config.OCCUPANCY_TOLERANCE by default
+    :return: a bool array of shape (len(pis), number of constraints), violated[i, idx] is True if idx is an unknown
+      feature changed by pis[i]
+    """
+    if tolerance is None: tolerance = config.OCCUPANCY_TOLERANCE
+
+    xs = []
+    for x in pis:
+      if not isinstance(x, Occupancy):
+        if not hasattr(self.mdp, 'sIndex'): self.mdp.computeIndices()
+        x = Occupancy.fromDict(x, self.mdp)
+      xs.append(x)
+
+    violated = numpy.zeros((len(xs), len(self.consStates)), dtype=bool)
+    if len(xs) == 0: return violated
+
+    # stack of occupancies of shape (policies, states, actions), summed over actions
+    visited = numpy.array([x.x for x in xs]).sum(axis=2) > tolerance
+    # S may be appended with other states after the occupancies are computed
+    incidence = self.getConsIncidence(xs[0].sIndex)[:, :visited.shape[1]]
 
-    for idx in self.unknownCons:
-      # states violated by idx
-      for s, a in x.keys():
-        if any(x[s, a] > 0 for a in self.mdp.A) and s in self.consStates[idx]:
-          var.append(idx)
-          break
-    
-    return var
+    violated[:, self.unknownCons] = (incidence.dot(visited.T.astype(int)).T > 0)[:, self.unknownCons]
+    return violated
 
   # syntax sugar functions for computing \prod_{feat} p_f(feat)
   def probFeatsBeingFree(self, feats):
-    return reduce(mul, map(lambda _: self.consProbs[_], feats), 1)
+    return reduce(mul, [self.consProbs[_] for _ in feats], 1)
   def probFeatsBeingLocked(self, feats):
-    return reduce(mul, map(lambda _: 1 - self.consProbs[_], feats), 1)
+    return reduce(mul, [1 - self.consProbs[_] for _ in feats], 1)
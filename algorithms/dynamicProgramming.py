@@ -0,0 +1,136 @@
+"""
+Dynamic programming solvers for problems with only zero constraints.
+Such a problem is an mdp where some states cannot be visited, which policy iteration solves exactly.
+"""
+import numpy
+from scipy import sparse
+from scipy.sparse import linalg
+
+from algorithms.lp import compileMDP, solutionCache, toOccupancy
+
+
+def constrainedPolicyIteration(mdp, zeroConstraints=()):
+  """
+  Same as lpDualGurobi(mdp, zeroConstraints), without positive constraints or unknown features.
+  The discount factor should be smaller than 1.
+
+  :return: {'feasible': if a safe policy exists,
+            'obj': the value of the optimal safe policy,
+            'pi': its occupancy measure}
+  """
+  compileMDP(mdp)
+
+  # lps and policy iteration find the same solutions, so they share the memoized ones
+  key = solutionCache.makeKey(mdp, zeroConstraints)
+  return solutionCache.lookup(key, lambda: solvePolicyIteration(mdp, zeroConstraints))
+
+def forbiddenStates(mdp, zeroConstraints=()):
+  """
+  :return: forbidden[s] is True if s is in any of zeroConstraints
+  """
+  forbidden = numpy.zeros(len(mdp.S), dtype=bool)
+  for states in zeroConstraints:
+    forbidden[[mdp.sIndex[s] for s in states]] = True
+  return forbidden
+
+def findSafeActions(mdp, forbidden):
+  """
+  An action is safe in a state if it never leads to a state that is forbidden or that has no safe actions.
+  As in lps, the occupancies of terminal states are not constrained, so they are always safe.
+
+  :param forbidden: forbidden[s] is True if s should not be visited
+  :return: (allowed, safe), where allowed[s, a] is True if a is safe in s, and safe[s] is True if s is safe
+  """
+  sLen = len(mdp.S)
+  aLen = len(mdp.A)
+
+  safe = ~forbidden | ~mdp.nonTerminal
+
+  while True:
+    # the probability of reaching unsafe states by each (s, a)
+    unsafeProbs = mdp.transitionMatrix.dot((~safe).astype(float)).reshape(sLen, aLen)
+    allowed = (unsafeProbs == 0) & safe[:, None]
+    newSafe = safe & (allowed.any(axis=1) | ~mdp.nonTerminal)
+
+    if numpy.array_equal(newSafe, safe):
+      return allowed, safe
+    else:
+      safe = newSafe
+
+def safePolicyExists(mdp, forbidden):
+  """
+  Whether some policy never visits forbidden states, which is whether a constrained lp with these zero constraints is
+  feasible when gamma < 1. It only propagates boolean arrays through the transition matrix, so no lp is solved.
+  mdp should be compiled.
+  """
+  allowed, safe = findSafeActions(mdp, forbidden)
+  return safe[mdp.alphaVec > 0].all()
+
+def findReachableStates(mdp, allowed):
+  """
+  :return: reached[s] is True if s can be reached from the initial states by allowed actions
+  """
+  actionsAllowed = allowed.ravel().astype(float)
+
+  reached = mdp.alphaVec > 0
+  frontier = reached
+  while frontier.any():
+    # flow leaves non-terminal states by allowed actions
+    flow = numpy.repeat(frontier & mdp.nonTerminal, len(mdp.A)) * actionsAllowed
+    frontier = (mdp.transitionMatrix.T.dot(flow) > 0) & ~reached
+    reached = reached | frontier
+
+  return reached
+
+def solvePolicyIteration(mdp, zeroConstraints=()):
+  """
+  constrainedPolicyIteration without memoization.
+  """
+  sLen = len(mdp.S)
+  aLen = len(mdp.A)
+  gamma = mdp.gamma
+  r = mdp.getRewardVector()
+
+  allowed, safe = findSafeActions(mdp, forbiddenStates(mdp, zeroConstraints))
+
+  if not safe[mdp.alphaVec > 0].all():
+    # the robot starts from a state where it has to visit forbidden states
+    return {'feasible': False, 'obj': 0, 'pi': None}
+
+  # states where the robot needs to make decisions. terminal states have values of 0
+  states = numpy.nonzero(findReachableStates(mdp, allowed) & mdp.nonTerminal)[0]
+  x = numpy.zeros(sLen * aLen)
+  if len(states) == 0:
+    # the initial states are terminal
+    return {'feasible': True, 'obj': 0, 'pi': toOccupancy(mdp, x)}
+
+  # restrict the transition matrix to these states
+  transitions = mdp.transitionMatrix[:, states]
+
+  # start with any safe policy
+  policy = numpy.argmax(allowed[states], axis=1)
+
+  while True:
+    # policy evaluation, V = r_pi + gamma * T_pi V
+    rows = states * aLen + policy
+    transitPi = transitions[rows]
+    values = linalg.spsolve(sparse.identity(len(states), format='csc') - gamma * transitPi.tocsc(), r[rows])
+
+    # policy improvement
+    q = (r + gamma * transitions.dot(values)).reshape(sLen, aLen)[states]
+    q[~allowed[states]] = -numpy.inf
+    currentQ = q[numpy.arange(len(states)), policy]
+    # only switch actions that improve the values by more than numerical errors
+    improvable = q.max(axis=1) > currentQ + 1e-8
+
+    if not improvable.any():
+      break
+    else:
+      policy = numpy.where(improvable, numpy.argmax(q, axis=1), policy)
+
+  # the occupancy of the greedy policy solves the flow conservation constraints, d = alpha + gamma * T_pi^T d
+  occ = linalg.spsolve(sparse.identity(len(states), format='csc') - gamma * transitPi.T.tocsc(), mdp.alphaVec[states])
+
+  x[rows] = occ
+
+  return {'feasible': True, 'obj': numpy.dot(r, x), 'pi': toOccupancy(mdp, x)}
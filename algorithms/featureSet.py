@@ -0,0 +1,109 @@
+"""
+Sets of features (indices of constraints) as bitmasks.
+iiss, relevant features of dominating policies and the subsets of constraints in the DomPolicies algorithm are all small
+sets of small integers, so set operations on them are a few integer operations.
+"""
+import numpy
+
+try:
+  # python 2 ints are bounded, sets of many features need long
+  integer = long
+except NameError:
+  integer = int
+
+
+class FeatureSet(integer):
+  """
+  An immutable set of features, where the bit (1 << feat) is set if feat is in the set.
+  It's an integer, so it's hashable and can be used in bitwise operations directly. It also behaves as a frozenset of
+  features, e.g. len(s), feat in s, iterating s (in increasing order), s | t, s & t, s - t and s.issubset(t).
+  """
+  __slots__ = ()
+
+  @classmethod
+  def of(cls, feats):
+    """
+    :param feats: an iterable of features, or a FeatureSet
+    """
+    if isinstance(feats, cls): return feats
+
+    mask = 0
+    for feat in feats:
+      mask |= 1 << feat
+    return cls(mask)
+
+  def __iter__(self):
+    mask = integer(self)
+    while mask:
+      lowest = mask & -mask
+      yield lowest.bit_length() - 1
+      mask ^= lowest
+
+  def __len__(self):
+    return bin(self).count('1')
+
+  def __contains__(self, feat):
+    return feat is not None and feat >= 0 and (integer(self) >> feat) & 1 == 1
+
+  def __or__(self, other):
+    return FeatureSet(integer(self) | integer(other))
+  __ror__ = __or__
+
+  def __and__(self, other):
+    return FeatureSet(integer(self) & integer(other))
+  __rand__ = __and__
+
+  def __sub__(self, other):
+    return FeatureSet(integer(self) & ~integer(other))
+
+  def add(self, feat):
+    """
+    :return: a new set with feat added
+    """
+    return FeatureSet(integer(self) | (1 << feat))
+
+  def remove(self, feat):
+    """
+    :return: a new set without feat
+    """
+    return FeatureSet(integer(self) & ~(1 << feat))
+
+  def union(self, other):
+    return self | FeatureSet.of(other)
+
+  def intersection(self, other):
+    return self & FeatureSet.of(other)
+
+  def difference(self, other):
+    return self - FeatureSet.of(other)
+
+  def issubset(self, other):
+    return integer(self) & ~integer(FeatureSet.of(other)) == 0
+
+  def issuperset(self, other):
+    return FeatureSet.of(other).issubset(self)
+
+  def isdisjoint(self, other):
+    return integer(self) & integer(FeatureSet.of(other)) == 0
+
+  def __repr__(self):
+    return 'FeatureSet(%s)' % list(self)
+  __str__ = __repr__
+
+
+def countSetsContainFeats(feats, sets):
+  """
+  :param sets: a list of FeatureSets
+  :return: an int array, the i-th element is the number of sets that contain feats[i]
+  """
+  feats = list(feats)
+  if len(sets) == 0 or len(feats) == 0:
+    return numpy.zeros(len(feats), dtype=int)
+
+  if max(feats) < 64 and max(sets) < 1 << 64:
+    # test the bits of all sets and features in one operation
+    masks = numpy.array([integer(s) for s in sets], dtype=numpy.uint64)
+    bits = (masks[:, None] >> numpy.array(feats, dtype=numpy.uint64)) & numpy.uint64(1)
+    return bits.sum(axis=0).astype(int)
+  else:
+    return numpy.array([sum(feat in s for s in sets) for feat in feats], dtype=int)
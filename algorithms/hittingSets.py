@@ -0,0 +1,147 @@
+"""
+Enumerating minimal hitting sets (minimal transversals) of a family of sets of features.
+The iiss are the minimal hitting sets of the relevant features of dominating policies: a set of locked features
+makes all dominating policies infeasible iff it intersects the relevant features of each of them.
+
+The MMCS algorithm is used,
+Murakami, Keisuke, and Takeaki Uno. "Efficient algorithms for dualizing large-scale hypergraphs."
+Discrete Applied Mathematics 170 (2014): 83-94.
+"""
+import time
+
+from algorithms.antichain import Antichain
+from algorithms.featureSet import FeatureSet
+
+
+class MinimalHittingSets:
+  """
+  Enumerate the minimal hitting sets of sets, adding them to self.found (an Antichain).
+
+  The enumeration can be capped by the size of the hitting sets and by time.
+  self.complete is True if all minimal hitting sets with at most maxSize features are found, i.e. the last
+  enumeration is not stopped by the time limit, and the sets are not updated in a way that may change them.
+  Otherwise, a later call of compute searches again from scratch, and only adds the ones that are not found.
+  """
+  def __init__(self, sets, maxSize=None, timeLimit=None):
+    """
+    :param sets: the sets to hit, not changed by this object
+    :param maxSize: only find hitting sets with at most this many features if not None
+    :param timeLimit: stop each call of compute after this many seconds if not None
+    """
+    self.sets = Antichain(sets)
+    self.maxSize = maxSize
+    self.timeLimit = timeLimit
+
+    self.found = Antichain()
+    # whether all minimal hitting sets (under maxSize) are found, and whether the last enumeration is stopped by time
+    self.complete = False
+    self.timedOut = False
+
+  def enumerate(self):
+    """
+    A generator of the minimal hitting sets that are not found yet. Each is added to self.found when yielded.
+    """
+    if self.timeLimit is None:
+      terminateCond = lambda: False
+    else:
+      startTime = time.time()
+      terminateCond = lambda: time.time() - startTime >= self.timeLimit
+
+    edges = list(self.sets)
+    feats = sorted(set(feat for edge in edges for feat in edge))
+    # feat -> bitmask of the indices of the edges that contain feat
+    occurrences = {feat: 0 for feat in feats}
+    for idx, edge in enumerate(edges):
+      for feat in edge:
+        occurrences[feat] |= 1 << idx
+
+    # crit[feat] is the bitmask of the edges that are only hit by feat in the current hitting set
+    crit = {}
+
+    def search(hittingSet, candidates, uncovered):
+      if terminateCond():
+        self.timedOut = True
+        return
+
+      if uncovered == 0:
+        yield hittingSet
+        return
+
+      if self.maxSize is not None and len(hittingSet) >= self.maxSize:
+        # larger hitting sets are not wanted, so this does not make the enumeration incomplete
+        return
+
+      # branch on the uncovered edge with the fewest candidates
+      uncoveredEdges = (edges[idx] for idx in FeatureSet(uncovered))
+      edgeCands = min((edge & candidates for edge in uncoveredEdges), key=len)
+      candidates = candidates - edgeCands
+
+      for feat in edgeCands:
+        # add feat. it's critical for the uncovered edges it hits, and other features are not critical for its edges
+        oldCrit = {other: crit[other] for other in hittingSet}
+        for other in hittingSet:
+          crit[other] &= ~occurrences[feat]
+        crit[feat] = uncovered & occurrences[feat]
+
+        # hittingSet + feat is minimal only if every feature in it is still critical for some edge
+        if all(crit[other] != 0 for other in hittingSet):
+          for found in search(hittingSet.add(feat), candidates, uncovered & ~occurrences[feat]):
+            yield found
+
+        crit.update(oldCrit)
+        del crit[feat]
+        candidates = candidates.add(feat)
+
+    self.complete = False
+    self.timedOut = False
+    for hittingSet in search(FeatureSet(0), FeatureSet.of(feats), (1 << len(edges)) - 1):
+      # the found ones are minimal hitting sets too, so they are either the same as or incomparable to hittingSet
+      if hittingSet not in self.found:
+        self.found.insert(hittingSet)
+        yield hittingSet
+
+    # the hitting sets found before are still minimal (see coverFeat and removeFeat), so nothing is missing
+    self.complete = not self.timedOut
+
+  def compute(self):
+    """
+    :return: all minimal hitting sets with at most maxSize features (unless stopped by time), as an Antichain
+    """
+    for _ in self.enumerate(): pass
+    return self.found
+
+  def coverFeat(self, feat):
+    """
+    feat can no longer hit any set (e.g. a free feature, which does not need to be in an iis),
+    so feat is removed from the sets to hit, and the hitting sets that contain feat are dropped.
+    The remaining hitting sets are still minimal and keep their sizes, so none is missing if none was missing before.
+    """
+    self.sets.removeFeat(feat)
+    self.found.coverFeat(feat)
+
+  def removeFeat(self, feat):
+    """
+    feat is known to hit the sets that contain it (e.g. a locked feature), so these sets no longer need to be hit,
+    and feat is removed from the hitting sets.
+    """
+    self.sets.coverFeat(feat)
+    self.found.removeFeat(feat)
+
+    if not self.complete or self.maxSize is not None:
+      # a hitting set without feat may not be minimal if other minimal ones were not found
+      for hittingSet in list(self.found):
+        if not self.isMinimal(hittingSet):
+          self.found.discard(hittingSet)
+
+    if self.maxSize is not None:
+      # hitting sets with maxSize + 1 features that contain feat are not found, but they have maxSize features now
+      self.complete = False
+
+  def isMinimal(self, hittingSet):
+    """
+    :return: True if hittingSet hits all sets, and not after removing any feature from it
+    """
+    if any(edge.isdisjoint(hittingSet) for edge in self.sets):
+      return False
+
+    return all(any(edge & hittingSet == 1 << feat for edge in self.sets) for feat in hittingSet)
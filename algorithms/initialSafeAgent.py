@@ -1,12 +1,18 @@
+from __future__ import print_function
+
 import copy
 import math
 import random
 import time
+from functools import reduce
 from itertools import combinations
 
 import config
 from algorithms import lp
+from algorithms.bdd import BDD
 from algorithms.consQueryAgents import ConsQueryAgent, NOTEXIST, EXIST
+from algorithms.featureSet import FeatureSet
+from algorithms.hittingSets import MinimalHittingSets
 from algorithms.setcover import coverFeat, removeFeat, killSupersets, numOfSetsContainFeat
 from operator import mul
 
@@ -29,6 +35,11 @@ class InitialSafePolicyAgent(ConsQueryAgent):
     # change partition of features
     ConsQueryAgent.updateFeats(self, newFreeCon, newLockedCon)
 
+    # condition the compiled dnf of safe policy existence on the response
+    if getattr(self, 'safePolicyBDD', None) is not None:
+      if newFreeCon is not None: self.safePolicyBDD.restrict(newFreeCon, free=True)
+      if newLockedCon is not None: self.safePolicyBDD.restrict(newLockedCon, free=False)
+
     # udpate the set cover structure
     # recompute dom pi and iiss every time if we're doing early stopping
     if config.earlyStop is not None:
@@ -59,12 +70,13 @@ class InitialSafePolicyAgent(ConsQueryAgent):
     if config.earlyStop is not None and hasattr(self, 'domPiFeats'):
       # if we have rel feat, simply check whether we covered all rel feats of any dom pi
       # this can only be used when earlyStop is not used, so we find exact domPiFeats
-      return any(len(set(relFeats) - set(freeCons)) == 0 for relFeats in self.domPiFeats)
+      freeMask = FeatureSet.of(freeCons)
+      return any(relFeats.issubset(freeMask) for relFeats in self.domPiFeats)
     else:
       # for some simple heuristics, it's not fair to ask them to precompute dompis (need to run a lot of LP)
-      # so we try to solve the lp problem once here
+      # so we check the feasibility of the lp problem once here
       # see whether the lp is feasible if we assume all other features are locked
-      return self.findConstrainedOptPi(set(self.unknownCons) - set(freeCons))['feasible']
+      return self.constrainedPolicyExists(set(self.unknownCons) - set(freeCons))
 
   def safePolicyNotExist(self, lockedCons=None):
     """
@@ -75,10 +87,11 @@ class InitialSafePolicyAgent(ConsQueryAgent):
       lockedCons = self.knownLockedCons
 
     if config.earlyStop is not None and hasattr(self, 'piRelFeats'):
-      return all(len(set(relFeats).intersection(lockedCons)) > 0 for relFeats in self.domPiFeats)
+      lockedMask = FeatureSet.of(lockedCons)
+      return all(not relFeats.isdisjoint(lockedMask) for relFeats in self.domPiFeats)
     else:
       # by only imposing these constraints, see whether the lp problem is infeasible
-      return not self.findConstrainedOptPi(lockedCons)['feasible']
+      return not self.constrainedPolicyExists(lockedCons)
 
   def checkSafePolicyExists(self):
     """
@@ -104,19 +117,22 @@ class InitialSafePolicyAgent(ConsQueryAgent):
     domPiFeats = []
     domPiFeatsAndValues = {}
 
-    for domPi in domPis:
-      feats = self.findViolatedConstraints(domPi)
+    violated = self.findViolatedConstraintsOfPolicies(domPis)
+    for (domPi, domPiViolated) in zip(domPis, violated):
+      feats = FeatureSet.of(idx for idx in self.unknownCons if domPiViolated[idx])
       # if this is a known-to-be-safe dom pi and we aim to improve safe policies,
       # don't add this to the set cover structure
       if len(feats) == 0 and self.improveSafePis: continue
 
       domPiFeats.append(feats)
       # FIXME it may be easier to store the values when the dom pis are computed. recomputing here.
-      domPiFeatsAndValues[tuple(feats)] = self.computeValue(domPi)
+      domPiFeatsAndValues[feats] = self.computeValue(domPi)
 
     self.domPiFeats = killSupersets(domPiFeats)
     self.domPiFeatsAndValues = domPiFeatsAndValues
     self.relFeats = relFeats # all relevant features
+    # compiled from domPiFeats when it's needed
+    self.safePolicyBDD = None
 
   def computeIISs(self, recompute=False):
     """
@@ -130,15 +146,10 @@ class InitialSafePolicyAgent(ConsQueryAgent):
     if not hasattr(self, 'piRelFeats'):
       self.computePolicyRelFeats()
 
-    iiss = [set()]
-    # essentially convert DNF to CNF
-    # incrementally consider more relFeats
-    for relFeats in self.domPiFeats:
-      iiss = [set(iis).union({relFeat}) for iis in iiss for relFeat in relFeats]
-      # kill duplicates in each set
-      iiss = killSupersets(iiss)
-
-    self.iiss = iiss
+    # essentially convert DNF to CNF, the iiss are the minimal hitting sets of domPiFeats
+    # the enumerator keeps them up-to-date when features are queried
+    self.iisEnumerator = MinimalHittingSets(self.domPiFeats, maxSize=config.IIS_MAX_SIZE, timeLimit=config.IIS_TIME_LIMIT)
+    self.iiss = self.iisEnumerator.compute()
 
   def computeIISsBruteForce(self):
     """
@@ -190,8 +201,6 @@ class InitialSafePolicyAgent(ConsQueryAgent):
       They might be different from the ones confirmed by querying.
       These are hypothetical ones just to compute the corresponding prob.
     """
-    result = 0
-
     def pf(con):
       if con in lockedCons: return 0
       elif con in freeCons: return 1
@@ -199,23 +208,12 @@ class InitialSafePolicyAgent(ConsQueryAgent):
 
     assert hasattr(self, 'domPiFeats')
 
-    # two ways to compute the probs. either 2^|relFeats| or 2^|domPis|
-    # so see which one is smaller
-    if len(self.relFeats) < len(self.domPiFeats):
-      allSubsetsOfRelFeats = powerset(self.relFeats)
-      for freeSubset in allSubsetsOfRelFeats:
-        if self.safePolicyExist(freeCons = list(freeSubset) + list(self.knownFreeCons)):
-          prob = self.probFeatsBeingFree(freeSubset) * self.probFeatsBeingLocked(set(self.relFeats) - set(freeSubset))
-          result += prob
-    else:
-      for k in range(1, len(self.domPiFeats) + 1):
-        sign = 1 if k % 2 == 1 else -1
-        for domPiFeatsSubset in combinations(self.domPiFeats, k):
-          domPiFeatsSubsetLists = map(lambda _: list(_), domPiFeatsSubset)
-          unionOfFeats = set(sum(domPiFeatsSubsetLists, []))
-          result += sign * reduce(mul, map(pf, unionOfFeats), 1)
+    # a safe policy exists iff all relevant features of some dom pi are free. compile this dnf once,
+    # then the probability is a weighted model count, linear in the size of the bdd
+    if getattr(self, 'safePolicyBDD', None) is None:
+      self.safePolicyBDD = BDD(self.domPiFeats)
 
-    return result
+    return self.safePolicyBDD.probability(pf)
 
 
 class GreedyForSafetyAgent(InitialSafePolicyAgent):
@@ -262,29 +260,35 @@ class GreedyForSafetyAgent(InitialSafePolicyAgent):
     d = len(self.relFeats) # number of relevant features
 
     A = [[1 if self.relFeats[j] in self.domPiFeats[i] else 0 for j in range(d)] for i in range(n)]
-    assert all(tuple(self.domPiFeats[i]) in self.domPiFeatsAndValues.keys() for i in range(n))
-    b = [self.domPiFeatsAndValues[tuple(self.domPiFeats[i])] for i in range(n)]
+    assert all(self.domPiFeats[i] in self.domPiFeatsAndValues for i in range(n))
+    b = [self.domPiFeatsAndValues[self.domPiFeats[i]] for i in range(n)]
     weights = lp.linearRegression(A, b)
 
     self.featureVals = {}
     for i in range(d): self.featureVals[self.relFeats[i]] = weights[i]
-    print 'feat vals', filter(lambda _: _[1] > 1e-4, self.featureVals.items())
+    print('feat vals', [_ for _ in self.featureVals.items() if _[1] > 1e-4])
 
   def updateFeats(self, newFreeCon=None, newLockedCon=None):
     # this just add to the list of known free and locked features
     InitialSafePolicyAgent.updateFeats(self, newFreeCon, newLockedCon)
 
+    # self.iiss is updated by its enumerator
     if newFreeCon is not None:
       if self.useIIS:
-        self.iiss = coverFeat(newFreeCon, self.iiss)
+        self.iisEnumerator.coverFeat(newFreeCon)
       if self.useRelPi:
-        self.domPiFeats = removeFeat(newFreeCon, self.domPiFeats)
+        self.domPiFeats.removeFeat(newFreeCon)
 
     if newLockedCon is not None:
       if self.useIIS:
-        self.iiss = removeFeat(newLockedCon, self.iiss)
+        self.iisEnumerator.removeFeat(newLockedCon)
       if self.useRelPi:
-        self.domPiFeats = coverFeat(newLockedCon, self.domPiFeats)
+        self.domPiFeats.coverFeat(newLockedCon)
+
+    if self.useIIS and not self.iisEnumerator.complete:
+      # search again for the iiss that are missing, because of the time limit or,
+      # under the size cap, because a locked feature is removed from larger iiss
+      self.iisEnumerator.compute()
 
   def findQuery(self, subsetCons=None):
     """
@@ -319,8 +323,8 @@ class GreedyForSafetyAgent(InitialSafePolicyAgent):
       if self.optimizeValue:
         # try to optimize values of the safe policies
         # we need IIS when trying to optimize the values of policies
-        score[con] = self.consProbs[con] * (self.costOfQuery - self.featureVals[con]) / len(filter(lambda _: con in _, self.iiss)) \
-                   + (1 - self.consProbs[con]) * self.costOfQuery / len(filter(lambda _: con in _, self.domPiFeats))
+        score[con] = self.consProbs[con] * (self.costOfQuery - self.featureVals[con]) / numOfSetsContainFeat(con, self.iiss) \
+                   + (1 - self.consProbs[con]) * self.costOfQuery / numOfSetsContainFeat(con, self.domPiFeats)
       else:
         # only aim to find a safe policy (regardless of its value)
         if self.heuristicID == 0:
@@ -363,7 +367,7 @@ class GreedyForSafetyAgent(InitialSafePolicyAgent):
       #score[con] += 1
 
     # to understand the behavior
-    return max(score.iteritems(), key=lambda _: _[1])[0]
+    return max(score.items(), key=lambda _: _[1])[0]
 
   def findKFeatureQuery(self):
     """
@@ -383,9 +387,9 @@ class GreedyForSafetyAgent(InitialSafePolicyAgent):
       relFeatUncoveredProbs = {}
 
       for iis in self.iiss:
-        iisUncoveredProbs[iis] = self.probFeatsBeingLocked(set(iis).intersection(query))
+        iisUncoveredProbs[iis] = self.probFeatsBeingLocked(iis.intersection(query))
       for feats in self.domPiFeats:
-        relFeatUncoveredProbs[feats] = self.probFeatsBeingFree(set(feats).intersection(query))
+        relFeatUncoveredProbs[feats] = self.probFeatsBeingFree(feats.intersection(query))
 
       score = {}
       for con in self.relFeats:
@@ -424,7 +428,7 @@ class DomPiHeuForSafetyAgent(InitialSafePolicyAgent):
 
     # find the policy that has the largest probability to be feasible
     feasibleProb = lambda relFeats: reduce(mul,
-                                           map(lambda _: updatedConsProbs[_], relFeats),
+                                           [updatedConsProbs[_] for _ in relFeats],
                                            1)
 
     maxProbPiRelFeats = max(self.domPiFeats, key=feasibleProb)
@@ -471,7 +475,7 @@ class MaxProbSafePolicyExistAgent(InitialSafePolicyAgent):
     # there should be unqueried features
     assert len(termProbs) > 0
 
-    return max(termProbs.iteritems(), key=lambda _: _[1])[0]
+    return max(termProbs.items(), key=lambda _: _[1])[0]
 
 
 class DescendProbQueryForSafetyAgent(InitialSafePolicyAgent):
@@ -576,8 +580,8 @@ class OptQueryForSafetyAgent(InitialSafePolicyAgent):
       else: admissibleFreeCons.append(freeCons)
 
     if config.DEBUG:
-      print 'locked', self.lockedBoundary
-      print 'free', self.freeBoundary
+      print('locked', self.lockedBoundary)
+      print('free', self.freeBoundary)
 
     for lockedCons in admissibleLockedCons:
       for freeCons in admissibleFreeCons:
@@ -598,7 +602,7 @@ class OptQueryForSafetyAgent(InitialSafePolicyAgent):
     # keep fill out the values of optQs within boundary
     # whenever filled out
     while len(readyToEvalSet) > 0:
-      if config.DEBUG: print len(readyToEvalSet), 'need to be evaluated'
+      if config.DEBUG: print(len(readyToEvalSet), 'need to be evaluated')
 
       (lockedCons, freeCons) = readyToEvalSet.pop()
 
@@ -615,9 +619,9 @@ class OptQueryForSafetyAgent(InitialSafePolicyAgent):
       self.setQueryAndValue(lockedCons, freeCons, minNums)
 
       # add neighbors that ready to evaluate to readToEvalSet
-      readyToEvalSet += filter(lambda (l, f): self.getQueryAndValue(l, f) == None and readyToEvaluate(l, f),
-                               [(set(lockedCons) - {cons}, freeCons) for cons in lockedCons] +\
-                               [(lockedCons, set(freeCons) - {cons}) for cons in freeCons])
+      readyToEvalSet += [(l, f) for (l, f) in [(set(lockedCons) - {cons}, freeCons) for cons in lockedCons] +\
+                                              [(lockedCons, set(freeCons) - {cons}) for cons in freeCons]
+                         if self.getQueryAndValue(l, f) == None and readyToEvaluate(l, f)]
 
   def findQuery(self):
     # we only care about the categories of rel feats
@@ -628,7 +632,7 @@ class OptQueryForSafetyAgent(InitialSafePolicyAgent):
     assert qAndV != None
 
     if config.VERBOSE:
-      print 'query and value', self.getQueryAndValue(relLockedCons, relFreeCons, allValues=True)
+      print('query and value', self.getQueryAndValue(relLockedCons, relFreeCons, allValues=True))
 
     return qAndV[0]
 
@@ -666,11 +670,11 @@ class OracleSafetyAgent(InitialSafePolicyAgent):
 
   def computeExactQueries(self):
     if self.safePolicyIndeedExist:
-      freePiFeats = filter(lambda _: set(self.trueFreeFeatures).issuperset(_), self.domPiFeats)
+      freePiFeats = [_ for _ in self.domPiFeats if _.issubset(self.trueFreeFeatures)]
       assert len(freePiFeats) > 0
       self.queries = min(freePiFeats, key=lambda _: len(_))
     else:
-      lockedIISs = filter(lambda _: set(self.trueLockedFeatures).issuperset(_), self.iiss)
+      lockedIISs = [_ for _ in self.iiss if _.issubset(self.trueLockedFeatures)]
       assert len(lockedIISs) > 0
       self.queries = min(lockedIISs, key=lambda _: len(_))
 
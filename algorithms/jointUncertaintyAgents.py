@@ -1,15 +1,24 @@
+from __future__ import print_function
+
 import copy
 import random
 from operator import mul
 
 import numpy
+from scipy import sparse
 
 import config
 from algorithms.consQueryAgents import ConsQueryAgent
 from algorithms.initialSafeAgent import GreedyForSafetyAgent
+from algorithms.lp import compileMDP
+from algorithms.lpCache import LRUCache
 from algorithms.rewardQueryAgents import GreedyConstructRewardAgent
+from domains.domainConstructors import MDPView
 from util import powerset, computePosteriorBelief, printOccSA
 
+# transition matrices with constraints encoded, shared by agents and copies of the same mdp
+encodedTransitionCache = LRUCache(config.ENCODED_TRANSITION_CACHE_SIZE)
+
 
 class JointUncertaintyQueryAgent(ConsQueryAgent):
   """
@@ -28,37 +37,37 @@ class JointUncertaintyQueryAgent(ConsQueryAgent):
     self.mdp.updatePsi(posterPsi)
 
   def computeConsistentRewardIndices(self, psi):
-    return filter(lambda rIdx: psi[rIdx] > 0, range(self.sizeOfRewards))
+    return [rIdx for rIdx in range(self.sizeOfRewards) if psi[rIdx] > 0]
 
   def encodeConstraintIntoTransition(self, mdp):
     """
     revise the transition function in-place
     when visit a state in consStates, go to a 'sink' state with prob of pf
     """
-    cons = [self.consStates[_] for _ in self.knownLockedCons + self.unknownCons]
-    pfs = [0 for _ in self.knownLockedCons] + [self.consProbs[_] for _ in self.unknownCons]
+    compileMDP(mdp)
+    sLen = len(mdp.S)
+    aLen = len(mdp.A)
 
-    # transit is going to be set 0, so make a copy here
-    transit = copy.deepcopy(mdp.transit)
-
-    newT = {}
-    for s in mdp.S:
-      for a in mdp.A:
-        # prob. of getting to transit(s, a)
-        sp = transit(s, a)
-        successProb = 1
-        for (consStates, pf) in zip(cons, pfs):
-          if sp in consStates:
-            successProb *= pf
+    consStateIndices = self.getConsStateIndices(mdp.sIndex)
+    cons = self.knownLockedCons + self.unknownCons
+    pfs = [0 for _ in self.knownLockedCons] + [self.consProbs[_] for _ in self.unknownCons]
 
-        newT[s, a, sp] = successProb
+    # prob. of getting to each state, instead of the sink
+    successProbs = numpy.ones(sLen)
+    for (consIdx, pf) in zip(cons, pfs):
+      successProbs[consStateIndices[consIdx]] *= pf
 
-        # prob. of reaching sink
-        newT[s, a, 'sink'] = 1 - successProb
+    # successProbs is determined by the known-locked constraints, the unknown constraints and consProbs
+    key = (mdp.fingerprint, successProbs.tobytes())
+    transitionProbs = encodedTransitionCache.lookup(key, lambda: self.encodeSuccessProbs(mdp, successProbs))
 
-    mdp.S.append('sink')
+    # not appended in place, mdp may be a view that shares S with its base
+    mdp.S = mdp.S + ['sink']
+    mdp.transitionProbs = transitionProbs
 
-    mdp.T = lambda s, a, sp: newT[s, a, sp] if (s, a, sp) in newT.keys() else 0
+    sIndex = {s: idx for idx, s in enumerate(mdp.S)}
+    aIndex = {a: idx for idx, a in enumerate(mdp.A)}
+    mdp.T = lambda s, a, sp: transitionProbs[sIndex[s] * aLen + aIndex[a], sIndex[sp]] if sp in sIndex else 0
 
     # make 'sink' terminal states
     terminal = copy.deepcopy(mdp.terminal)
@@ -66,7 +75,26 @@ class JointUncertaintyQueryAgent(ConsQueryAgent):
 
     # these are for deterministic transitions, they shouldn't be called (just to make sure)
     mdp.transit = None
-    mdp.invertT = None
+    mdp.nextState = None
+    # S, T and terminal are changed, so compiled constraints need to be recomputed
+    mdp.resetCompiled()
+
+  def encodeSuccessProbs(self, mdp, successProbs):
+    """
+    :param successProbs: successProbs[s'] is the prob. of getting to s' instead of the sink
+    :return: a sparse matrix of shape ((|S| + 1) * |A|, |S| + 1), where the last state is the sink.
+      T(s, a, s') is scaled by successProbs[s'], and the rest of the prob. goes to the sink.
+      The sink has no next states.
+    """
+    aLen = len(mdp.A)
+
+    transitions = mdp.transitionMatrix
+    toSink = transitions.dot(1 - successProbs)
+    transitions = sparse.hstack([transitions.dot(sparse.diags(successProbs)), toSink[:, None]])
+    # rows of the actions of the sink
+    transitions = sparse.vstack([transitions, sparse.csr_matrix((aLen, transitions.shape[1]))]).tocsr()
+    transitions.eliminate_zeros()
+    return transitions
 
   def computeEVOI(self, query):
     """
@@ -87,11 +115,11 @@ class JointUncertaintyQueryAgent(ConsQueryAgent):
     elif qType == 'R':
       rIndices = qContent
 
-      mdpIfTrueReward = copy.deepcopy(self.mdp)
+      mdpIfTrueReward = MDPView(self.mdp)
       mdpIfTrueReward.updatePsi(computePosteriorBelief(mdpIfTrueReward.psi, consistentRewards=rIndices))
       posteriorValueIfTrue = self.findConstrainedOptPi(activeCons=self.unknownCons, mdp=mdpIfTrueReward)['obj']
 
-      mdpIfFalseReward = copy.deepcopy(self.mdp)
+      mdpIfFalseReward = MDPView(self.mdp)
       mdpIfFalseReward.updatePsi(computePosteriorBelief(mdpIfFalseReward.psi, inconsistentRewards=rIndices))
       posteriorValueIfFalse = self.findConstrainedOptPi(activeCons=self.unknownCons, mdp=mdpIfFalseReward)['obj']
 
@@ -115,7 +143,7 @@ class JointUncertaintyQueryAgent(ConsQueryAgent):
     for query in queries:
       queryAndEVOIs.append((query, self.computeEVOI(query)))
 
-    if config.VERBOSE: print 'select query by EVOI', queryAndEVOIs
+    if config.VERBOSE: print('select query by EVOI', queryAndEVOIs)
 
     # break the tie randomly
     #maxEVOI = max(evoi for (q, evoi) in queryAndEVOIs)
@@ -154,13 +182,13 @@ class JointUncertaintyOptimalQueryAgent(JointUncertaintyQueryAgent):
     # use frozenset here because the order of features doesn't matter
     key = (frozenset(knownLockedCons), frozenset(knownFreeCons), frozenset(unknownCons), tuple(psi))
 
-    if key in self.optQueryAndValueDict.keys():
+    if key in self.optQueryAndValueDict:
       return self.optQueryAndValueDict[key]
 
     rewardSupports = self.computeConsistentRewardIndices(psi)
     self.imaginedMDP.updatePsi(psi)
     # compute the current safe policy
-    if key in self.currentOptPiValueDict.keys():
+    if key in self.currentOptPiValueDict:
       currentSafelyOptValue = self.currentOptPiValueDict[key]
     else:
       currentSafelyOptValue = self.findConstrainedOptPi(activeCons=list(unknownCons)+list(knownLockedCons),
@@ -223,14 +251,14 @@ class JointUncertaintyQueryByMyopicSelectionAgent(JointUncertaintyQueryAgent):
     encode consStates and pf into the transition function,
     then use greedy construction and projection to find close-to-optimal reward query
     """
-    psiSupports = filter(lambda _: _ > 0, self.mdp.psi)
+    psiSupports = [_ for _ in self.mdp.psi if _ > 0]
     # psi cannot have 0 support
     assert len(psiSupports) > 0
     # if the true reward function is known, no need to pose more reward queries
     if len(psiSupports) == 1: return None
 
-    # going to modify the transition function in place, so make a copy of mdp
-    mdp = copy.deepcopy(self.mdp)
+    # going to modify the transition function, so make a view of mdp
+    mdp = MDPView(self.mdp)
     # encode pf into the transition probabilities
     self.encodeConstraintIntoTransition(mdp)
     rewardQueryAgent = GreedyConstructRewardAgent(mdp, 2, qi=True)
@@ -239,10 +267,10 @@ class JointUncertaintyQueryByMyopicSelectionAgent(JointUncertaintyQueryAgent):
     rewardQuery = rewardQueryAgent.findRewardSetQuery()[0]
     psiSupportsAndQR = sum(self.mdp.psi[idx] > 0 for idx in rewardQuery)
 
-    if config.VERBOSE: print 'reward query', rewardQuery
+    if config.VERBOSE: print('reward query', rewardQuery)
 
     if psiSupportsAndQR == 0 or psiSupportsAndQR == len(psiSupports):
-      if config.VERBOSE: print 'not reporting reward query back'
+      if config.VERBOSE: print('not reporting reward query back')
       return None
     else:
       return rewardQuery
@@ -267,11 +295,11 @@ class JointUncertaintyQueryByMyopicSelectionAgent(JointUncertaintyQueryAgent):
 
     # after computing rel feats, check if it's empty. if so, nothing need to be queried.
     if len(featureQueryAgent.domPiFeats) == 0 or len(featureQueryAgent.iiss) == 0:
-      if config.VERBOSE: print 'not reporting feature query back'
+      if config.VERBOSE: print('not reporting feature query back')
       return None
     else:
       query = featureQueryAgent.findQuery(subsetCons=subsetCons)
-      if config.VERBOSE: print 'feature query', query
+      if config.VERBOSE: print('feature query', query)
       return query
 
   def findQuery(self):
@@ -327,7 +355,7 @@ class JointUncertaintyQueryBySamplingDomPisAgent(JointUncertaintyQueryAgent):
     consistentRewardIndices = self.computeConsistentRewardIndices(self.mdp.psi)
 
     for rIndices in powerset(consistentRewardIndices, minimum=1, maximum=self.sizeOfRewards):
-      rewardPositiveMDP = copy.deepcopy(self.mdp)
+      rewardPositiveMDP = MDPView(self.mdp)
       rewardPositiveMDP.updatePsi(computePosteriorBelief(self.mdp.psi, consistentRewards=rIndices))
 
       sumOfPsi = sum(self.mdp.psi[_] for _ in rIndices)
@@ -336,8 +364,9 @@ class JointUncertaintyQueryBySamplingDomPisAgent(JointUncertaintyQueryAgent):
                                                knownFreeCons=self.knownFreeCons, knownLockedCons=self.knownLockedCons)
       _, domPis = rewardPositiveConsAgent.findRelevantFeaturesAndDomPis()
 
-      for domPi in domPis:
-        relFeats = rewardPositiveConsAgent.findViolatedConstraints(domPi)
+      violated = rewardPositiveConsAgent.findViolatedConstraintsOfPolicies(domPis)
+      for (domPi, domPiViolated) in zip(domPis, violated):
+        relFeats = [idx for idx in rewardPositiveConsAgent.unknownCons if domPiViolated[idx]]
 
         # we are going to query about rIndices and relFeatures
         # we regard them as batch queries and compute the possible responses
@@ -368,7 +397,7 @@ class JointUncertaintyQueryBySamplingDomPisAgent(JointUncertaintyQueryAgent):
     else:
       self.objectDomPiData = None
 
-    if config.VERBOSE: print 'chosen dom pi', self.objectDomPiData
+    if config.VERBOSE: print('chosen dom pi', self.objectDomPiData)
 
   def attemptToFindQuery(self):
     """
@@ -379,18 +408,18 @@ class JointUncertaintyQueryBySamplingDomPisAgent(JointUncertaintyQueryAgent):
 
     # if not assigned, compute it
     if self.objectDomPiData is None:
-      if config.VERBOSE: print 'dompi not assigned'
+      if config.VERBOSE: print('dompi not assigned')
       return None
 
     # if some relevant features are now known-to-be-locked, we should find another dom pi
     if len(set(self.knownLockedCons).intersection(self.objectDomPiData.violatedCons)) > 0:
-      if config.VERBOSE: print 'dompi not safe'
+      if config.VERBOSE: print('dompi not safe')
       return None
 
     consistentRewardIndices = self.computeConsistentRewardIndices(self.mdp.psi)
     # if any of the reward functions tha domPi optimizes is not possibly a true reward function
     if not set(self.objectDomPiData.optimizedRewards).issubset(consistentRewardIndices):
-      if config.VERBOSE: print 'some optimized reward known to be false'
+      if config.VERBOSE: print('some optimized reward known to be false')
       return None
 
     # compute a reward query based on objective dompi
@@ -404,7 +433,7 @@ class JointUncertaintyQueryBySamplingDomPisAgent(JointUncertaintyQueryAgent):
     queries += [('F', feat) for feat in unknownRelFeats]
 
     if len(queries) == 0:
-      if config.VERBOSE: print 'nothing to query'
+      if config.VERBOSE: print('nothing to query')
       return None
     else:
       return self.selectQueryBasedOnEVOI(queries, considerCost=False)
@@ -430,8 +459,8 @@ class JointUncertaintyRandomQuery(JointUncertaintyQueryAgent):
   def findQuery(self):
     featQueries = [('F', feat) for feat in self.unknownCons]
 
-    psiSupports = filter(lambda _: _ > 0, self.mdp.psi)
-    rewardQuery = ('R', filter(lambda _: random.random() > .5, psiSupports))
+    psiSupports = [_ for _ in self.mdp.psi if _ > 0]
+    rewardQuery = ('R', [_ for _ in psiSupports if random.random() > .5])
     noneQuery = None
 
     return random.choice(featQueries + [rewardQuery] + [noneQuery])
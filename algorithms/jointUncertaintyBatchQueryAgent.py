@@ -1,9 +1,12 @@
-import copy
+from __future__ import print_function
+
+import numpy
 
 import config
 from algorithms.jointUncertaintyAgents import JointUncertaintyQueryByMyopicSelectionAgent
 from algorithms.lp import lpDualGurobi, jointUncertaintyMilp
 from algorithms.rewardQueryAgents import GreedyConstructRewardAgent
+from domains.domainConstructors import MDPView
 from util import printOccSA
 
 
@@ -21,16 +24,27 @@ class JointUncertaintyBatchQueryAgent(JointUncertaintyQueryByMyopicSelectionAgen
     """
     zC[i] = 1 if the i-th unknown feature is changed by pi, 0 otherwise.
     """
-    relFeats = self.findViolatedConstraints(pi)
-    return [_ in relFeats for _ in range(len(self.unknownCons))]
+    return [bool(z) for z in self.computeZCs([pi])[0]]
+
+  def computeZCs(self, pis):
+    """
+    computeZC for all policies in pis, as an array of shape (len(pis), number of unknown features)
+    """
+    return self.findViolatedConstraintsOfPolicies(pis)[:, :len(self.unknownCons)]
 
   def computeValue(self, x, r=None):
     """
     compute value of policy - cost of querying
     """
-    if r is None: r = self.mdp.r
     return GreedyConstructRewardAgent.computeValue(self, x, r) - self.costOfQuery * sum(self.computeZC(x))
 
+  def computeValues(self, q):
+    """
+    values of policies in q under all reward candidates - cost of querying
+    """
+    costs = self.costOfQuery * self.computeZCs(q).sum(axis=1)
+    return GreedyConstructRewardAgent.computeValues(self, q) - costs[:, None]
+
   def findOptPolicyUnderMeanRewards(self, psi=None):
     """
     Find the first policy in the policy query by optimizing the objective (V - cost of query)
@@ -38,7 +52,7 @@ class JointUncertaintyBatchQueryAgent(JointUncertaintyQueryByMyopicSelectionAgen
     :return: the initial policy in the policy query
     """
     if psi is not None:
-      mdp = copy.deepcopy(self.mdp)
+      mdp = MDPView(self.mdp)
       mdp.updatePsi(psi)
     else:
       mdp = self.mdp
@@ -63,16 +77,12 @@ class JointUncertaintyBatchQueryAgent(JointUncertaintyQueryByMyopicSelectionAgen
     note that this is not the exact objective which qPi tries to optimize, since we do not want to consider all possible
     realizations of changeability of unknown features.
 
-    :return: E_{r, \Phi \in \Phi_\unknown} \max_{\pi \in (qPi \cap \Pi_\Phi) } V^\pi_r
+    :return: E_{r, \Phi \in \Phi_\\unknown} \max_{\pi \in (qPi \cap \Pi_\Phi) } V^\pi_r
     """
-    piIndices = range(len(qPi))
-    ret = 0
-    for (r, rProb) in zip(self.mdp.rFuncs, self.mdp.psi):
-      piValues = [self.computeValue(qPi[piIdx], r) for piIdx in piIndices]
-      maxSafePiValue = max(piValues)
-      ret += maxSafePiValue * rProb
+    # the value of the best policy in qPi for each reward function
+    maxSafePiValues = self.computeValues(qPi).max(axis=0)
 
-    return ret
+    return numpy.dot(self.mdp.psi, maxSafePiValues)
 
   def findBatchQuery(self):
     """
@@ -99,28 +109,28 @@ class JointUncertaintyBatchQueryAgent(JointUncertaintyQueryByMyopicSelectionAgen
     evoi = eus - self.costOfQuery * (qR is not None) - priorValue
 
     if config.VERBOSE:
-      print 'evoi', evoi, '=', eus, '-', self.costOfQuery, '*', (qR is not None), '-', priorValue
+      print('evoi', evoi, '=', eus, '-', self.costOfQuery, '*', (qR is not None), '-', priorValue)
 
     if evoi <= 1e-4:
       return None
 
     # find feat query
-    qFeats = set()
-    for pi in qPi:
-      violatedCons = self.findViolatedConstraints(pi)
-      qFeats = qFeats.union(violatedCons)
+    violated = self.findViolatedConstraintsOfPolicies(qPi).any(axis=0)
+    qFeats = set(idx for idx in self.unknownCons if violated[idx])
 
     # return selected reward query and feature query
     # if they ask about nothing (which is None), then don't include in the candidate queries
-    queries = filter(lambda _: _[1] is not None, [('R', qR)] + [('F', qFeat) for qFeat in qFeats])
+    queries = [_ for _ in [('R', qR)] + [('F', qFeat) for qFeat in qFeats] if _[1] is not None]
     return queries
 
   def findQuery(self):
     # find an instance of good reward query + feature queries
     # for now, recompute batch queries in each step
-    currentMDP = copy.deepcopy(self.mdp)
+    # findBatchQuery changes the transition function of self.mdp, so let it work on a view
+    currentMDP = self.mdp
+    self.mdp = MDPView(currentMDP)
     queries = self.findBatchQuery()
-    # recover the current mdp FIXME better way to do this?
+    # recover the current mdp
     self.mdp = currentMDP
 
     # in this case, not worth querying
@@ -1,17 +1,48 @@
+from __future__ import print_function
+
+import time
+
+import numpy
+from scipy import sparse
+
 import config
 import util
+from algorithms.lpCache import LPCache, LRUCache
+from algorithms.occupancy import Occupancy
 
 if config.OPT_METHOD == 'gurobi':
   from gurobipy import *
 elif config.OPT_METHOD == 'cplex':
   from pycpx import CPlexModel, CPlexException, CPlexNoSolution
+elif config.OPT_METHOD == 'highs':
+  # open-source solver, needs scipy >= 1.9 for optimize.milp and linprog(method='highs')
+  import scipy
+  from scipy import optimize
+  if not hasattr(optimize, 'milp'):
+    # fail here instead of in the middle of a solve
+    raise ImportError("OPT_METHOD = 'highs' needs scipy >= 1.9 (scipy.optimize.milp), but scipy " + scipy.__version__ +
+                      " is installed. Run on Python 3 with a newer scipy (scipy >= 1.9 does not support Python 2).")
 else:
   raise Exception('unknown optimization method ' + config.OPT_METHOD)
 
+# memoized solutions of constrained lps, shared by all agents
+solutionCache = LPCache(config.LP_CACHE_SIZE)
+
+# accumulated statistics of mip solves, e.g. for benchmarkBigM.py. reset by resetMIPStats
+mipStats = {'solves': 0, 'nodes': 0, 'time': 0.0}
+
+# used for big-M constraints when occupancies are not bounded by discounting (gamma = 1)
+DEFAULT_BIG_M = 10000
+
 def linearRegression(A, b):
   """
-  find min_x ||Ax - b||^2
+  find min_x ||Ax - b||^2, where x >= 0
   """
+  if config.OPT_METHOD == 'highs':
+    # this is a non-negative least squares problem, which scipy solves directly
+    x, _ = optimize.nnls(numpy.array(A, dtype=float), numpy.array(b, dtype=float))
+    return list(x)
+
   m = Model()
   m.setParam('OutputFlag', False)
 
@@ -24,11 +55,265 @@ def linearRegression(A, b):
   # ** is not supported by gurobi!
   square = lambda _: _ * _
   # \sum_i (A[i] * x - b[i])^2
-  m.setObjective(sum(square(sum(A[i][j] * x[j] for j in xrange(d)) - b[i])
-                     for i in xrange(n)), GRB.MINIMIZE)
+  m.setObjective(sum(square(sum(A[i][j] * x[j] for j in range(d)) - b[i])
+                     for i in range(n)), GRB.MINIMIZE)
+  m.optimize()
+
+  return [x[_].X for _ in range(d)]
+
+def resetMIPStats():
+  mipStats.update({'solves': 0, 'nodes': 0, 'time': 0.0})
+
+def occupancyBound(mdp):
+  """
+  An upper bound of the total occupancy, \sum_{s, a} x[s, a] <= \sum_s alpha(s) / (1 - gamma). mdp should be compiled.
+  """
+  if mdp.gamma < 1:
+    return mdp.alphaVec.sum() / (1 - mdp.gamma)
+  else:
+    return DEFAULT_BIG_M
+
+def valueBounds(mdp, rewardMatrix):
+  """
+  :return: (lower, upper), lower[i] <= \sum_{s, a} x[s, a] R[i](s, a) <= upper[i] for any occupancy x
+  """
+  rewards = rewardMatrix.toarray()
+  bound = occupancyBound(mdp)
+  return (bound * numpy.minimum(rewards.min(axis=1), 0), bound * numpy.maximum(rewards.max(axis=1), 0))
+
+def bigM(tightM):
+  """
+  Big-M constants of indicator constraints.
+
+  :param tightM: an array of the smallest valid M's, derived from the mdp
+  :return: tightM, or config.BIG_M for all the constraints if set (the old formulation)
+  """
+  if config.BIG_M is None:
+    return numpy.array(tightM, dtype=float)
+  else:
+    return numpy.full(numpy.shape(tightM), float(config.BIG_M))
+
+def compileMDP(mdp):
+  """
+  Make sure the flow conservation constraints of mdp are compiled.
+  They are computed once and reused by all following lp calls on mdp.
+  """
+  if mdp.flowMatrix is None: mdp.computeFlowMatrix()
+  if mdp.alphaVec is None: mdp.computeInitialDistribution()
+  if mdp.fingerprint is None: mdp.computeFingerprint()
+
+def stateOccupancySelector(mdp, stateSets):
+  """
+  :param stateSets: [[states] for each constraint]
+  :return: a sparse matrix, the i-th row of which sums up the occupancies of all actions in stateSets[i]
+  """
+  aLen = len(mdp.A)
+
+  rows = []
+  cols = []
+  for consIdx in range(len(stateSets)):
+    sIndices = numpy.array([mdp.sIndex[s] for s in stateSets[consIdx]], dtype=int)
+    # columns of (s, a) for all a
+    consCols = (sIndices[:, None] * aLen + numpy.arange(aLen)).ravel()
+    rows.append(numpy.full(len(consCols), consIdx, dtype=int))
+    cols.append(consCols)
+
+  rows = numpy.concatenate(rows) if len(rows) > 0 else numpy.zeros(0, dtype=int)
+  cols = numpy.concatenate(cols) if len(cols) > 0 else numpy.zeros(0, dtype=int)
+  return sparse.csr_matrix((numpy.ones(len(rows)), (rows, cols)), shape=(len(stateSets), len(mdp.S) * aLen))
+
+def toOccupancy(mdp, x):
+  """
+  :param x: occupancies indexed by s * |A| + a, may be followed by other variables
+  :return: an Occupancy on mdp
+  """
+  xLen = len(mdp.S) * len(mdp.A)
+  return Occupancy(x[:xLen].reshape(len(mdp.S), len(mdp.A)), mdp.S, mdp.A, mdp.sIndex, mdp.aIndex)
+
+def reachableOccupancies(mdp, zeroConstraints=()):
+  """
+  Variable elimination for zero constraints.
+  The occupancies of states in zeroConstraints are 0, and so are the occupancies of states that can only be reached
+  through them. Only the remaining occupancies need to be variables of the lp.
+
+  :return: indices (s * |A| + a) of occupancies that can be positive
+  """
+  forbidden = numpy.zeros(len(mdp.S), dtype=bool)
+  for states in zeroConstraints:
+    forbidden[[mdp.sIndex[s] for s in states]] = True
+
+  # flow only leaves non-terminal states that are not forbidden
+  sources = (mdp.nonTerminal & ~forbidden).astype(float)
+  reached = (mdp.alphaVec > 0) & ~forbidden
+  frontier = reached
+  while frontier.any():
+    frontier = (mdp.successors.T.dot(frontier * sources) > 0) & ~reached & ~forbidden
+    reached = reached | frontier
+
+  return numpy.nonzero(numpy.repeat(reached, len(mdp.A)))[0]
+
+def restrictToColumns(A, sense, b, cols):
+  """
+  Keep the variables in cols, and drop the rows that become 0 = 0.
+  The flow constraints of forbidden states are kept, so no flow goes into them.
+
+  :return: (A, sense, b) on the variables in cols
+  """
+  A = A[:, cols].tocsr()
+  sense = numpy.array(sense)
+  b = numpy.array(b, dtype=float)
+
+  keep = (numpy.diff(A.indptr) > 0) | (sense != '=') | (b != 0)
+  return A[keep], list(sense[keep]), list(b[keep])
+
+def expandOccupancy(mdp, cols, v):
+  """
+  :param v: values of the variables in cols, may be followed by other variables
+  :return: occupancies of all (s, a), the eliminated ones are 0
+  """
+  x = numpy.zeros(len(mdp.S) * len(mdp.A))
+  x[cols] = v[:len(cols)]
+  return x
+
+def occupancyConstraints(mdp, positiveConstraints=(), positiveConstraintsOcc=0):
+  """
+  Constraints of lpDualGurobi that do not depend on features. They are
+
+  flow conservation constraints. for each non-terminal s',
+  \sum_{s, a} x(s, a) (1_{s = s'} - \gamma * T(s, a, s')) = \alpha(s')
+  where only occupancies of non-terminal states s flow to s'
+
+  >= constraints. the occupancy of positiveConstraints should be at least positiveConstraintsOcc
+
+  :return: (A, sense, b) of these constraints on x
+  """
+  nonTerminalCols = numpy.repeat(mdp.nonTerminal, len(mdp.A)).astype(float)
+  flow = mdp.flowMatrix[mdp.nonTerminal].dot(sparse.diags(nonTerminalCols))
+  rows = [flow]
+  sense = ['='] * flow.shape[0]
+  b = list(mdp.alphaVec[mdp.nonTerminal])
+
+  if len(positiveConstraints) > 0:
+    #FIXME positiveConstraints still have actions in them. in consistent with other types of constraints
+    rows.append(stateActionOccupancySelector(mdp, [positiveConstraints]))
+    sense += ['>']
+    b += [positiveConstraintsOcc]
+
+  return sparse.vstack(rows).tocsr(), sense, b
+
+def stateActionOccupancySelector(mdp, saSets):
+  """
+  :param saSets: [[(s, a) pairs] for each constraint]
+  :return: a sparse matrix, the i-th row of which sums up the occupancies of (s, a) pairs in saSets[i]
+  """
+  aLen = len(mdp.A)
+
+  rows = [consIdx for consIdx in range(len(saSets)) for _ in saSets[consIdx]]
+  cols = [mdp.sIndex[s] * aLen + mdp.aIndex[a] for saSet in saSets for s, a in saSet]
+  return sparse.csr_matrix((numpy.ones(len(rows)), (rows, cols)), shape=(len(saSets), len(mdp.S) * aLen))
+
+def solveLinearModel(c, A, sense, b, ub, vtype, start=None):
+  """
+  Solve max c^T v s.t. A v (sense) b, 0 <= v <= ub, where all constraints are added in bulk.
+  The problem is solved by the backend specified by config.OPT_METHOD.
+
+  :param sense: an array of '=', '<' or '>' for each row of A
+  :param ub: upper bounds of variables, numpy.inf if unbounded
+  :param vtype: an array of 'C' (continuous) or 'B' (binary) for each variable
+  :param start: a (partial) MIP start, numpy.nan for variables without start values.
+    only used by gurobi, scipy's milp does not take an initial solution.
+  :return: {'feasible': if an optimal solution is found, 'obj': the objective value, 'v': the optimal solution}
+  """
+  c = numpy.array(c, dtype=float)
+  sense = numpy.array(sense)
+  b = numpy.array(b, dtype=float)
+  ub = numpy.array(ub, dtype=float)
+  vtype = numpy.array(vtype)
+
+  if len(c) == 0:
+    # no variables left, e.g. all occupancies are eliminated. feasible if 0 satisfies all the constraints
+    feasible = (((sense == '=') & (b == 0)) | ((sense == '<') & (b >= 0)) | ((sense == '>') & (b <= 0))).all()
+    return {'feasible': feasible, 'obj': 0, 'v': numpy.zeros(0) if feasible else None, 'nodes': 0, 'time': 0}
+
+  if config.OPT_METHOD == 'gurobi':
+    sol = solveLinearModelGurobi(c, A, sense, b, ub, vtype, start)
+  elif config.OPT_METHOD == 'highs':
+    sol = solveLinearModelHiGHS(c, A, sense, b, ub, vtype)
+  else:
+    raise Exception('unsupported method ' + config.OPT_METHOD)
+
+  if any(vtype == 'B'):
+    mipStats['solves'] += 1
+    mipStats['nodes'] += sol['nodes']
+    mipStats['time'] += sol['time']
+
+  return sol
+
+def solveLinearModelGurobi(c, A, sense, b, ub, vtype, start=None):
+  m = Model()
+  m.setParam('OutputFlag', False)
+
+  v = m.addMVar(len(c), lb=0, ub=list(numpy.minimum(ub, GRB.INFINITY)), obj=list(c), vtype=list(vtype))
+  m.ModelSense = GRB.MAXIMIZE
+  if A.shape[0] > 0:
+    m.addMConstr(A, v, sense, b)
+
+  if start is not None:
+    # gurobi completes a partial start by solving the sub-mip of the undefined variables
+    v.setAttr('Start', list(numpy.where(numpy.isnan(start), GRB.UNDEFINED, start)))
+
   m.optimize()
 
-  return [x[_].X for _ in xrange(d)]
+  sol = readGurobiSolution(m, v)
+  sol['nodes'] = m.NodeCount if m.IsMIP else 0
+  sol['time'] = m.Runtime
+  return sol
+
+def readGurobiSolution(m, v):
+  if m.status == GRB.Status.OPTIMAL:
+    # .X attribute is to retrieve the value of the variable
+    return {'feasible': True, 'obj': m.objVal, 'v': v.X}
+  elif m.status in [GRB.Status.INF_OR_UNBD, GRB.Status.INFEASIBLE]:
+    return {'feasible': False, 'obj': 0, 'v': None}
+  else:
+    raise Exception('error status: %d' % m.status)
+
+def solveLinearModelHiGHS(c, A, sense, b, ub, vtype):
+  start = time.time()
+
+  # scipy minimizes the objective
+  bounds = numpy.column_stack([numpy.zeros(len(c)), ub])
+
+  if any(vtype == 'B'):
+    # lower and upper bounds of each row
+    rowLb = numpy.where(sense == '<', -numpy.inf, b)
+    rowUb = numpy.where(sense == '>', numpy.inf, b)
+    constraints = optimize.LinearConstraint(A, rowLb, rowUb) if A.shape[0] > 0 else None
+    res = optimize.milp(-c, constraints=constraints, integrality=(vtype == 'B').astype(int),
+                        bounds=optimize.Bounds(bounds[:, 0], bounds[:, 1]))
+  else:
+    # linprog needs <= rows and == rows separately
+    eqRows = numpy.where(sense == '=')[0]
+    leRows = numpy.where(sense == '<')[0]
+    geRows = numpy.where(sense == '>')[0]
+    ineq = sparse.vstack([A[leRows], -A[geRows]]).tocsr()
+    ineqB = numpy.concatenate([b[leRows], -b[geRows]])
+    res = optimize.linprog(-c,
+                           A_ub=ineq if len(ineqB) > 0 else None, b_ub=ineqB if len(ineqB) > 0 else None,
+                           A_eq=A[eqRows] if len(eqRows) > 0 else None, b_eq=b[eqRows] if len(eqRows) > 0 else None,
+                           bounds=bounds, method='highs')
+
+  # status 0 is optimal, 2 is infeasible (same for both linprog and milp)
+  if res.status == 0:
+    sol = {'feasible': True, 'obj': -res.fun, 'v': res.x}
+  elif res.status == 2:
+    sol = {'feasible': False, 'obj': 0, 'v': None}
+  else:
+    raise Exception('error status: %d, %s' % (res.status, res.message))
+
+  sol['nodes'] = res.get('mip_node_count', 0)
+  sol['time'] = time.time() - start
+  return sol
 
 def lpDualGurobi(mdp, zeroConstraints=(), positiveConstraints=(), positiveConstraintsOcc=0, unknownStateCons=(), violationCost=None):
   """
@@ -36,6 +321,11 @@ def lpDualGurobi(mdp, zeroConstraints=(), positiveConstraints=(), positiveConstr
   This function is overridden. If violationCost is not None, then we punish the robot by changing an unknown feature.
   Otherwise unknown features are imposed as hard constraints.
 
+  The constraint matrix is assembled from the precompiled mdp.flowMatrix, so building the model scales with the number
+  of nonzeros instead of |S|^2 |A| calls of T.
+  Despite the name, the problem is solved by the backend in config.OPT_METHOD (gurobi or highs).
+  Solutions without violation costs are memoized in solutionCache.
+
   :param violationCost: if not None, it's the cost of violating a constraint rather than enforcing it.
   :return: {'feasible': if a feasible solution is found,
             'obj': the objective value,
@@ -44,81 +334,179 @@ def lpDualGurobi(mdp, zeroConstraints=(), positiveConstraints=(), positiveConstr
   if len(positiveConstraints) == 0 and positiveConstraintsOcc > 0:
     return {'feasible': False}
 
-  S = mdp.S
-  A = mdp.A
-  T = mdp.T
-  r = mdp.r
-  gamma = mdp.gamma
-  alpha = mdp.alpha
-  terminal = mdp.terminal
-  
-  # initialize a Gurobi model
-  m = Model()
-  m.setParam('OutputFlag', False)
+  compileMDP(mdp)
 
-  # useful constants
-  Sr = range(len(S))
-  Ar = range(len(A))
+  if len(unknownStateCons) > 0:
+    # the solution depends on the unknown features, not memoized
+    return solveLpDual(mdp, zeroConstraints, positiveConstraints, positiveConstraintsOcc, unknownStateCons, violationCost)
 
-  x = m.addVars(len(S), len(A), lb=0, name='x')
+  key = solutionCache.makeKey(mdp, zeroConstraints, positiveConstraints, positiveConstraintsOcc)
+  return solutionCache.lookup(key, lambda: solveLpDual(mdp, zeroConstraints, positiveConstraints, positiveConstraintsOcc))
 
-  M = 10000  # a large number
+def solveLpDual(mdp, zeroConstraints=(), positiveConstraints=(), positiveConstraintsOcc=0, unknownStateCons=(), violationCost=None):
+  """
+  lpDualGurobi without memoization. mdp should be compiled.
+  """
+  # the occupancy of states in each of zeroConstraints should be 0
+  # instead of adding constraints, these occupancies (and unreachable ones) are not variables at all
+  cols = reachableOccupancies(mdp, zeroConstraints)
+
+  # useful constants
+  xLen = len(cols)
+  zLen = len(unknownStateCons)
 
+  # variables are [x, zC], where x only has the occupancies in cols
   # use integer variables to indicate which constraints are violated
   # not going to returned this though.. the indices are wrong (we excluded known-to-be-locked/free features)
-  zC = m.addVars(len(unknownStateCons), vtype=GRB.BINARY, name='zC')
-
-  nonTerminalStatesRange = filter(lambda _: not terminal(S[_]), Sr)
-
-  # flow conservation constraints. for each s',
-  # \sum_{s, a} x(s, a) (1_{s = s'} - \gamma * T(s, a, s')) = \alpha(s')
-  if mdp.invertT is not None:
-    # if invertT is computed for deterministic domains, this can be much more efficient
-    # sp ('next state' in the transition) are non-terminal states
-    for sp in nonTerminalStatesRange:
-      # supports of 1_{s = s'}
-      identityItems = [(sp, a) for a in Ar]
-      # supports of \gamma * T(s, a, s')
-      invertedTransitItems = map(lambda _: (S.index(_[0]), A.index(_[1])), mdp.invertT[S[sp]])
-      # kill duplicates
-      supports = tuple(set(identityItems).union(invertedTransitItems))
-      m.addConstr(sum(x[s, a] * ((s == sp) - gamma * T(S[s], A[a], S[sp])) for (s, a) in supports) == alpha(S[sp]))
-  else:
-    # the normal way, exactly as specified in the formula
-    # note that we need to iterate overall state, action pairs for each s' \in S
-    for sp in nonTerminalStatesRange:
-      m.addConstr(sum(x[s, a] * ((s == sp) - gamma * T(S[s], A[a], S[sp])) for s in nonTerminalStatesRange for a in Ar) == alpha(S[sp]))
-
-  # >= constraints. the occupancy should be at least positiveConstraintsOcc
-  if len(positiveConstraints) > 0:
-    #FIXME positiveConstraints still have actions in them. in consistent with other types of constraints
-    m.addConstr(sum(x[S.index(s), A.index(a)] for s, a in positiveConstraints) >= positiveConstraintsOcc)
-    
-  if len(zeroConstraints) > 0:
-    for consIdx in range(len(zeroConstraints)):
-      m.addConstr(sum(x[S.index(s), A.index(a)] for s in zeroConstraints[consIdx] for a in A) == 0)
-
-  # add cost of queries
-  if len(unknownStateCons) > 0:
-    for consIdx in range(len(unknownStateCons)):
-      m.addConstr(M * zC[consIdx] >= sum(x[S.index(s), A.index(a)] for s in unknownStateCons[consIdx] for a in A))
+  occ, sense, b = occupancyConstraints(mdp, positiveConstraints, positiveConstraintsOcc)
+  occ, sense, b = restrictToColumns(occ, sense, b, cols)
+  rows = [sparse.hstack([occ, sparse.csr_matrix((occ.shape[0], zLen))])]
+
+  # add cost of queries, M * zC >= occupancy of states in unknownStateCons
+  # where M bounds the occupancy
+  if zLen > 0:
+    unknown = stateOccupancySelector(mdp, unknownStateCons)[:, cols]
+    M = bigM(numpy.full(zLen, occupancyBound(mdp)))
+    rows.append(sparse.hstack([unknown, -sparse.diags(M)]))
+    sense += ['<'] * zLen
+    b += [0] * zLen
 
   # obj
-  m.setObjective(sum([x[s, a] * r(S[s], A[a]) for s in Sr for a in Ar])
-                 - sum(zC[consIdx] * violationCost for consIdx in range(len(unknownStateCons))),
-                 GRB.MAXIMIZE)
+  c = numpy.concatenate([mdp.getRewardVector()[cols], -violationCost * numpy.ones(zLen) if zLen > 0 else []])
+  ub = [numpy.inf] * xLen + [1] * zLen
+  vtype = ['C'] * xLen + ['B'] * zLen
 
-  m.optimize()
+  sol = solveLinearModel(c, sparse.vstack(rows).tocsr(), sense, b, ub, vtype)
 
-  if m.status == GRB.Status.OPTIMAL:
+  if sol['feasible']:
     # return feasible being true and the obj value, opt pi
-    # .X attribute is to retrieve the value of the variable
-    return {'feasible': True, 'obj': m.objVal, 'pi': {(S[s], A[a]): x[s, a].X for s in Sr for a in Ar}}
-  elif m.status == GRB.Status.INF_OR_UNBD:
+    return {'feasible': True, 'obj': sol['obj'], 'pi': toOccupancy(mdp, expandOccupancy(mdp, cols, sol['v']))}
+  else:
     # simply return infeasible
     return {'feasible': False, 'obj': 0, 'pi': None}
-  else:
-    raise Exception('error status: %d' % m.status)
+
+
+class LPSession:
+  """
+  A long-lived lpDualGurobi problem of an mdp structure (see SimpleMDP.computeFingerprint), where the zero constraints,
+  the goal constraints and the reward change between solves. It's shared by all mdps with the same fingerprint,
+  e.g. copies and views of an mdp, see lpSessions.
+
+  A zero constraint forces the occupancies of a set of states to be 0, which is imposed here by fixing the upper bounds
+  of these occupancies (and the ones that become unreachable) to 0 instead of adding rows.
+  A goal constraint is a row that is added the first time its goals are seen, and switched on or off by its right-hand
+  side (a row with rhs 0 is always satisfied since occupancies are nonnegative).
+  With gurobi, changing bounds, right-hand sides and the objective keeps the model,
+  so each re-solve warm-starts from the previous simplex basis. With highs, the compiled constraints are reused.
+  """
+  def __init__(self, mdp):
+    compileMDP(mdp)
+
+    self.fingerprint = mdp.fingerprint
+    self.xLen = len(mdp.S) * len(mdp.A)
+    # the flow constraints
+    self.A, self.sense, self.b = occupancyConstraints(mdp)
+
+    # occupancies of goals (a frozenset of columns) -> the row that sums them up
+    self.goalRows = {}
+    # the goals and the occupancy of the goal row that is switched on, if any
+    self.activeGoals = None
+    self.activeGoalsOcc = 0
+
+    # the reward vector used by the last solve
+    self.c = None
+
+    if config.OPT_METHOD == 'gurobi':
+      self.m = Model()
+      self.m.setParam('OutputFlag', False)
+      self.x = self.m.addMVar(self.xLen, lb=0)
+      self.m.ModelSense = GRB.MAXIMIZE
+      self.m.addMConstr(self.A, self.x, numpy.array(self.sense), numpy.array(self.b, dtype=float))
+
+  def solve(self, mdp, zeroConstraints=(), positiveConstraints=(), positiveConstraintsOcc=0):
+    """
+    Same as lpDualGurobi(mdp, zeroConstraints, positiveConstraints, positiveConstraintsOcc), but reusing the model.
+    mdp should have the same fingerprint as the one this session is built on.
+    """
+    if len(positiveConstraints) == 0 and positiveConstraintsOcc > 0:
+      return {'feasible': False}
+
+    key = solutionCache.makeKey(mdp, zeroConstraints, positiveConstraints, positiveConstraintsOcc)
+    return solutionCache.lookup(key, lambda: self.solveUncached(mdp, zeroConstraints, positiveConstraints,
+                                                                positiveConstraintsOcc))
+
+  def setGoals(self, mdp, positiveConstraints=(), positiveConstraintsOcc=0):
+    """
+    Switch on the goal row of positiveConstraints (adding it if it's new), and switch off the previous one.
+    """
+    if len(positiveConstraints) > 0:
+      aLen = len(mdp.A)
+      goals = frozenset(mdp.sIndex[s] * aLen + mdp.aIndex[a] for s, a in positiveConstraints)
+    else:
+      goals = None
+    if goals == self.activeGoals and positiveConstraintsOcc == self.activeGoalsOcc: return
+
+    if goals is not None and goals not in self.goalRows:
+      row = stateActionOccupancySelector(mdp, [positiveConstraints])
+      if config.OPT_METHOD == 'gurobi':
+        self.goalRows[goals] = self.m.addMConstr(row, self.x, '>', numpy.zeros(1))
+      else:
+        self.goalRows[goals] = row
+
+    if config.OPT_METHOD == 'gurobi':
+      if self.activeGoals is not None:
+        self.goalRows[self.activeGoals].setAttr('RHS', numpy.zeros(1))
+      if goals is not None:
+        self.goalRows[goals].setAttr('RHS', numpy.array([positiveConstraintsOcc], dtype=float))
+
+    self.activeGoals = goals
+    self.activeGoalsOcc = positiveConstraintsOcc
+
+  def solveUncached(self, mdp, zeroConstraints=(), positiveConstraints=(), positiveConstraintsOcc=0):
+    c = mdp.getRewardVector()
+    # occupancies that are not eliminated by zero constraints
+    cols = reachableOccupancies(mdp, zeroConstraints)
+
+    self.setGoals(mdp, positiveConstraints, positiveConstraintsOcc)
+
+    if config.OPT_METHOD == 'gurobi':
+      # switch on zero constraints by fixing upper bounds of the eliminated occupancies
+      ub = numpy.zeros(self.xLen)
+      ub[cols] = GRB.INFINITY
+
+      if self.c is None or not numpy.array_equal(c, self.c):
+        self.x.setAttr('Obj', c)
+      self.x.setAttr('UB', ub)
+      self.m.optimize()
+      sol = readGurobiSolution(self.m, self.x)
+    else:
+      # solve the reduced lp from scratch, with the goal row if it's switched on
+      if self.activeGoals is not None and self.activeGoalsOcc > 0:
+        A = sparse.vstack([self.A, self.goalRows[self.activeGoals]]).tocsr()
+        sense = self.sense + ['>']
+        b = self.b + [self.activeGoalsOcc]
+      else:
+        A, sense, b = self.A, self.sense, self.b
+      A, sense, b = restrictToColumns(A, sense, b, cols)
+      sol = solveLinearModel(c[cols], A, sense, b, [numpy.inf] * len(cols), ['C'] * len(cols))
+      if sol['feasible']: sol['v'] = expandOccupancy(mdp, cols, sol['v'])
+
+    self.c = c
+
+    if sol['feasible']:
+      return {'feasible': True, 'obj': sol['obj'], 'pi': toOccupancy(mdp, sol['v'])}
+    else:
+      return {'feasible': False, 'obj': 0, 'pi': None}
+
+# lp sessions by the fingerprints of mdps, each keeps a solver model
+lpSessions = LRUCache(config.LP_SESSION_CACHE_SIZE)
+
+def getLPSession(mdp):
+  """
+  :return: the lp session of mdp, shared by the mdps with the same fingerprint
+  """
+  compileMDP(mdp)
+  return lpSessions.lookup(mdp.fingerprint, lambda: LPSession(mdp))
 
 def lpDualCPLEX(mdp, zeroConstraints=(), positiveConstraints=(), positiveConstraintsOcc=1):
   """
@@ -161,67 +549,84 @@ def lpDualCPLEX(mdp, zeroConstraints=(), positiveConstraints=(), positiveConstra
   try:
     obj = m.maximize(sum([x[s, a] * r(S[s], A[a]) for s in Sr for a in Ar]))
   except CPlexException as err:
-    print 'Exception', err
+    print('Exception', err)
     # we return obj value as None and occ measure as {}. this should be handled correctly
     return {'feasible': False}
 
   return {'feasible': True, 'obj': obj, 'pi': {(S[s], A[a]): m[x][s, a] for s in Sr for a in Ar}}
 
-def milp(mdp, maxV, zeroConstraints=()):
+def rewardSupport(mdp):
+  """
+  :return: indices of reward candidates with positive probabilities.
+    the y variables of other rewards have zero coefficients in the objectives of the milps below, so they are dropped.
+  """
+  return numpy.nonzero(numpy.array(mdp.psi) > 0)[0]
+
+def milp(mdp, maxV, zeroConstraints=(), start=None):
   """
   Solve the MILP problem in greedy construction of policy query
 
   :param maxV maxV[i] = max_{\pi \in q} V_{r_i}^\pi
+  :param start: a policy to warm-start the solver, e.g. the policy previously added to the query
   """
-  m = Model()
-  m.setParam('OutputFlag', False)
+  compileMDP(mdp)
 
   # convert notation to previous implementation
   S = mdp.S
   A = mdp.A
-  R = mdp.rFuncs
-  psi = mdp.psi
-  T = mdp.T
-  alpha = mdp.alpha
-  gamma = mdp.gamma
+  support = rewardSupport(mdp)
+  psi = numpy.array(mdp.psi)[support]
+  maxV = numpy.array(maxV)[support]
 
   # useful constants
-  rLen = len(R)
-  M = 10000  # a large number
-  Sr = range(len(S))
-  Ar = range(len(A))
-
-  # decision variables
-  x = m.addVars(len(S), len(A), lb=0, name='x')
-  z = m.addVars(rLen, vtype=GRB.BINARY, name='z')
-  y = m.addVars(rLen, name='y')
-
-  # constraints on y
-  for i in range(rLen):
-    m.addConstr(y[i] <= sum([x[s, a] * R[i](S[s], A[a]) for s in Sr for a in Ar]) - maxV[i] + (1 - z[i]) * M)
-    m.addConstr(y[i] <= z[i] * M)
-
-  # constraints on x (valid occupancy)
-  for sp in Sr:
-    m.addConstr(sum(x[s, a] * ((s == sp) - gamma * T(S[s], A[a], S[sp])) for s in Sr for a in Ar) == alpha(S[sp]))
+  rLen = len(support)
+  xLen = len(S) * len(A)
+
+  # decision variables are [x, z, y]
+  # rewards of the reward candidates in the support, one row for each candidate
+  rewardMatrix = mdp.getRewardTensor()[support]
+  rIdentity = sparse.identity(rLen)
+
+  # the big-M's are the ranges of the left-hand sides, so the constraints are loose when z[i] says so
+  (lowerV, upperV) = valueBounds(mdp, rewardMatrix)
+  M1 = bigM(maxV - lowerV)
+  M2 = bigM(numpy.maximum(upperV - maxV, 0))
+
+  blocks = [# constraints on y
+            # y[i] <= \sum_{s, a} x[s, a] R[i](s, a) - maxV[i] + (1 - z[i]) * M1[i]
+            [-rewardMatrix, sparse.diags(M1), rIdentity],
+            # y[i] <= z[i] * M2[i]
+            [None, -sparse.diags(M2), rIdentity],
+            # constraints on x (valid occupancy)
+            [mdp.flowMatrix, sparse.csr_matrix((len(S), rLen)), None]]
+  sense = ['<'] * (2 * rLen) + ['='] * len(S)
+  b = list(M1 - maxV) + [0] * rLen + list(mdp.alphaVec)
 
   # == constraints
-  for consIdx in range(len(zeroConstraints)):
-    m.addConstr(sum(x[S.index(s), A.index(a)] for s, a in zeroConstraints[consIdx]) == 0)
+  if len(zeroConstraints) > 0:
+    blocks.append([stateActionOccupancySelector(mdp, zeroConstraints), None, None])
+    sense += ['='] * len(zeroConstraints)
+    b += [0] * len(zeroConstraints)
+
   # obj
-  m.setObjective(sum([psi[i] * y[i] for i in xrange(rLen)]), GRB.MAXIMIZE)
+  c = numpy.concatenate([numpy.zeros(xLen + rLen), psi])
+  ub = [numpy.inf] * xLen + [1] * rLen + [numpy.inf] * rLen
+  vtype = ['C'] * xLen + ['B'] * rLen + ['C'] * rLen
 
-  m.optimize()
+  if start is not None:
+    # start with the occupancy of the given policy, and y[i] being its improvement over maxV[i]
+    startX = start.x.ravel()
+    startY = numpy.maximum(rewardMatrix.dot(startX) - maxV, 0)
+    start = numpy.concatenate([startX, startY > 0, startY])
 
-  pi = {(S[s], A[a]): x[s, a].X for s in Sr for a in Ar}
+  sol = solveLinearModel(c, sparse.bmat(blocks, format='csr'), sense, b, ub, vtype, start)
 
-  if m.status == GRB.Status.OPTIMAL:
+  if sol['feasible']:
     # return feasible being true and the obj value, opt pi
-    # .X attribute is to retrieve the value of the variable
-    return pi
+    return toOccupancy(mdp, sol['v'])
   else:
     # simply return infeasible
-    raise Exception('milp problem optimal solution not found' + m.status)
+    raise Exception('milp problem optimal solution not found')
 
 def jointUncertaintyMilp(mdp, oldPi, oldZC, unknownFeatStates, costOfQuery):
   """
@@ -235,89 +640,118 @@ def jointUncertaintyMilp(mdp, oldPi, oldZC, unknownFeatStates, costOfQuery):
   :param unknownFeatStates: the states which the robot may change, but need to pay the query cost.
   :param costOfQuery: the cost of querying.
   """
-  m = Model()
-  m.setParam('OutputFlag', False)
+  compileMDP(mdp)
 
   # convert notation to previous implementation
   S = mdp.S
   A = mdp.A
-  R = mdp.rFuncs
-  psi = mdp.psi
-  T = mdp.T
-  alpha = mdp.alpha
-  gamma = mdp.gamma
+  support = rewardSupport(mdp)
+  psi = numpy.array(mdp.psi)[support]
 
   # useful constants
-  rLen = len(R)
-  M = 10000  # a large number
-  Sr = range(len(S))
-  Ar = range(len(A))
-
-  # decision variables
-  x = m.addVars(len(S), len(A), lb=0, name='x')
-  y = m.addVars(rLen, name='y')
-  # y prime, a helper variable
-  y0 = m.addVars(rLen, name='y0', lb=0)
-
-  # oldPi is a mapping from state, action (in S x A) to occupancy
-  # to be consistent with x, convert it to a mapping from (s, a) where s in Sr, a in Ar
-  oldX = {(s, a): oldPi[S[s], A[a]] for s in Sr for a in Ar}
+  rLen = len(support)
+  cLen = len(unknownFeatStates)
+  xLen = len(S) * len(A)
 
-  # integer variables
-  zR = m.addVars(rLen, vtype=GRB.BINARY, name='zR')
-  zC = m.addVars(len(unknownFeatStates), vtype=GRB.BINARY, name='zC')
+  # decision variables are [x, y, y0, zR, zC, zCNew, zSafe]
+  # y0 is y prime, a helper variable
   # zCNew indicates the newly changed features by x. note that it does not need to be constrained as integers
-  zCNew = m.addVars(len(unknownFeatStates), lb=0, name='zCNew')
-
-  zSafe = m.addVar(vtype=GRB.BINARY, name='zSafe')
-
-  V = lambda x_local, r: sum([x_local[s, a] * r(S[s], A[a]) for s in Sr for a in Ar])
+  offsets = numpy.cumsum([0, xLen, rLen, rLen, rLen, cLen, cLen, 1])
+  (xStart, yStart, y0Start, zRStart, zCStart, zCNewStart, zSafeIdx, varLen) = offsets
+
+  # to be consistent with x, convert oldPi to a vector indexed by s * |A| + a
+  if not isinstance(oldPi, Occupancy): oldPi = Occupancy.fromDict(oldPi, mdp)
+  oldX = oldPi.x.ravel()
+
+  rewardMatrix = mdp.getRewardTensor()[support]
+  # V(oldX, R[i]) for all i in the support
+  oldValues = rewardMatrix.dot(oldX)
+
+  rows = []
+  sense = []
+  b = []
+
+  def addRows(blocks, rowSense, rowB):
+    """
+    blocks: {start index of variables: coefficient matrix}, variables not in blocks have coefficients of 0
+    """
+    rowLen = len(rowB)
+    rows.append(sparse.hstack([blocks[start] if start in blocks else sparse.csr_matrix((rowLen, end - start))
+                               for start, end in zip(offsets[:-1], offsets[1:])]))
+    sense.extend([rowSense] * rowLen)
+    b.extend(rowB)
+
+  rIdentity = sparse.identity(rLen)
+  cIdentity = sparse.identity(cLen)
 
   # (a) flow conservation constraint
-  for sp in Sr:
-    m.addConstr(sum(x[s, a] * ((s == sp) - gamma * T(S[s], A[a], S[sp])) for s in Sr for a in Ar) == alpha(S[sp]))
+  addRows({xStart: mdp.flowMatrix}, '=', list(mdp.alphaVec))
 
   # (b) is encoded in the transition function
 
-  for consIdx in range(len(unknownFeatStates)):
-    # (c) unknown features can be changed
-    m.addConstr(M * zC[consIdx] >= sum(x[S.index(s), A.index(a)] for s in unknownFeatStates[consIdx] for a in A))
+  if cLen > 0:
+    # (c) unknown features can be changed, M * zC >= occupancy of unknownFeatStates, where M bounds the occupancy
+    MC = bigM(numpy.full(cLen, occupancyBound(mdp)))
+    addRows({xStart: stateOccupancySelector(mdp, unknownFeatStates), zCStart: -sparse.diags(MC)}, '<', [0] * cLen)
     # (d) constrain z^{new}_\phi, note that lb of zCNew is 0
-    m.addConstr(zCNew[consIdx] >= zC[consIdx] - oldZC[consIdx])
+    addRows({zCStart: -cIdentity, zCNewStart: cIdentity}, '>', [-oldZC[idx] for idx in range(cLen)])
 
   # (e) constraints on y^0_r
-  m.addConstr(sum(zC[idx] for idx in range(len(oldZC)) if oldZC[idx] == 1) <= sum(oldZC) - 1 + zSafe * M)
-  for i in range(rLen):
-    m.addConstr(y0[i] >= V(oldX, R[i]) - (1 - zSafe) * M)
+  # the left-hand side of the first constraint is at most sum(oldZC), so M = 1 is enough
+  oldChanged = sparse.csr_matrix(numpy.array([[1.0 if oldZC[idx] == 1 else 0.0 for idx in range(cLen)]]))
+  ME = bigM(numpy.ones(1))
+  addRows({zCStart: oldChanged, zSafeIdx: sparse.csr_matrix(-ME[:, None])}, '<', [sum(oldZC) - 1])
+  # y0 >= 0 already when the old policy is not safe
+  MY0 = bigM(numpy.maximum(oldValues, 0))
+  addRows({y0Start: rIdentity, zSafeIdx: sparse.csr_matrix(-MY0[:, None])}, '>', list(oldValues - MY0))
 
   # (f) constraints on y_r
-  for i in range(rLen):
-    m.addConstr(y[i] <= V(x, R[i]) - y0[i] + (1 - zR[i]) * M)
-    m.addConstr(y[i] <= 0 + zR[i] * M)
+  # y0 can be as small as max(oldValues, 0), and y <= V_r(x) - y0 <= upperV
+  (lowerV, upperV) = valueBounds(mdp, rewardMatrix)
+  MF1 = bigM(numpy.maximum(oldValues, 0) - lowerV)
+  MF2 = bigM(upperV)
+  addRows({xStart: -rewardMatrix, yStart: rIdentity, y0Start: rIdentity, zRStart: sparse.diags(MF1)}, '<', list(MF1))
+  addRows({yStart: rIdentity, zRStart: -sparse.diags(MF2)}, '<', [0] * rLen)
 
   # obj
-  m.setObjective(sum([psi[i] * y[i] for i in xrange(rLen)])
-                 - sum(zC[idx] * costOfQuery for idx in range(len(unknownFeatStates))),
-                 GRB.MAXIMIZE)
+  c = numpy.zeros(varLen)
+  c[yStart:y0Start] = psi
+  c[zCStart:zCNewStart] = -costOfQuery
 
-  m.optimize()
+  ub = numpy.full(varLen, numpy.inf)
+  ub[zRStart:zCNewStart] = 1
+  ub[zSafeIdx] = 1
+
+  vtype = numpy.array(['C'] * varLen)
+  vtype[zRStart:zCNewStart] = 'B'
+  vtype[zSafeIdx] = 'B'
+
+  # warm-start with oldPi, which is feasible when it changes the same features (zC = oldZC, zSafe = 1)
+  # and gains nothing over itself (y = 0, y0 = oldValues)
+  start = numpy.zeros(varLen)
+  start[xStart:yStart] = oldX
+  start[y0Start:zRStart] = numpy.maximum(oldValues, 0)
+  start[zCStart:zCNewStart] = oldZC
+  start[zSafeIdx] = 1
+
+  sol = solveLinearModel(c, sparse.vstack(rows).tocsr(), sense, b, ub, vtype, start)
+
+  if not sol['feasible']:
+    # simply return infeasible
+    raise Exception('milp problem optimal solution not found')
 
-  pi = {(S[s], A[a]): x[s, a].X for s in Sr for a in Ar}
+  v = sol['v']
+  pi = toOccupancy(mdp, v)
 
   if config.VERBOSE:
     # print decision variables other than pi for debugging
-    print 'oldZC', oldZC
-    print 'zC', [zC[consIdx].X for consIdx in range(len(unknownFeatStates))]
-    print 'y0 values', [y0[rIdx].X for rIdx in range(rLen)]
-    print 'y values', [y[rIdx].X for rIdx in range(rLen)]
+    print('oldZC', oldZC)
+    print('zC', list(v[zCStart:zCNewStart]))
+    print('y0 values', list(v[y0Start:zRStart]))
+    print('y values', list(v[yStart:y0Start]))
 
-  if m.status == GRB.Status.OPTIMAL:
-    # return feasible being true and the obj value, opt pi
-    # .X attribute is to retrieve the value of the variable
-    return pi
-  else:
-    # simply return infeasible
-    raise Exception('milp problem optimal solution not found' + m.status)
+  # return feasible being true and the obj value, opt pi
+  return pi
 
 """
 Utility functions to compute values, uncertain objectives, etc.
@@ -326,7 +760,7 @@ def computeObj(q, psi, S, A, R):
   rLen = len(R)
   obj = 0
 
-  for i in xrange(rLen):
+  for i in range(rLen):
     values = [computeValue(pi, R[i], S, A) for pi in q]
     obj += psi[i] * max(values)
     #print filter(lambda _: values[_] == max(values), range(len(q))), max(values)
@@ -336,10 +770,36 @@ def computeObj(q, psi, S, A, R):
 def computeValue(pi, r, S, A):
   sum = 0
 
-  if pi == {}:
+  if isinstance(pi, Occupancy):
+    # only need to evaluate rewards where the occupancy is positive
+    for (s, a), occ in pi.nonZeroItems():
+      sum += occ * r(s, a)
+    return sum
+  elif pi == {}:
     return sum
   else:
     for s in S:
       for a in A:
         sum += pi[s, a] * r(s, a)
     return sum
+
+def computeValues(pis, rewards):
+  """
+  Values of a set of policies under a set of rewards, computed by a single matrix product.
+
+  :param pis: a list of Occupancy
+  :param rewards: a (sparse) matrix, one row for each reward function, indexed by s * |A| + a
+  :return: values[i, j] = value of pis[i] under rewards[j]
+  """
+  X = numpy.array([pi.x.ravel() for pi in pis])
+  return numpy.asarray(rewards.dot(X.T)).T
+
+def computePolicyValue(pi, mdp):
+  """
+  :return: the value of pi under the reward of mdp (mdp.r)
+  """
+  rVec = mdp.getRewardVector()
+  if isinstance(pi, Occupancy) and pi.x.size == len(rVec):
+    return pi.dot(rVec)
+  else:
+    return computeValue(pi, mdp.r, mdp.S, mdp.A)
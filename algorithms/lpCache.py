@@ -0,0 +1,81 @@
+import collections
+
+import config
+
+
+class LRUCache:
+  """
+  A bounded cache that drops the least recently used value when it's full.
+  """
+  def __init__(self, maxSize):
+    self.maxSize = maxSize
+    self.values = collections.OrderedDict()
+
+    # counters for sizing the cache
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def lookup(self, key, compute):
+    """
+    :param key: a hashable key, or None if the value can't be memoized
+    :param compute: a function that computes the value, called when key is not memoized
+    :return: the value of key
+    """
+    if key is None or self.maxSize <= 0:
+      return compute()
+
+    if key in self.values:
+      self.hits += 1
+      # move it to the most recently used end
+      value = self.values.pop(key)
+      self.values[key] = value
+      return value
+
+    self.misses += 1
+    value = compute()
+    self.values[key] = value
+
+    if len(self.values) > self.maxSize:
+      # drop the least recently used value
+      self.values.popitem(last=False)
+      self.evictions += 1
+
+    return value
+
+  def stats(self):
+    return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self.values)}
+
+  def clear(self):
+    self.values.clear()
+    self.hits = self.misses = self.evictions = 0
+
+
+class LPCache(LRUCache):
+  """
+  A bounded LRU cache of constrained lp solutions.
+
+  The same constrained lp is solved many times, e.g. in computeEVOI, safePolicyExist and by different agents on copies of
+  the same mdp. A solution only depends on the mdp, the states that cannot be visited, the goal constraints and psi,
+  so different subsets of constraints that forbid the same states share one solution.
+  """
+  def makeKey(self, mdp, zeroConstraints=(), positiveConstraints=(), positiveConstraintsOcc=0):
+    """
+    :return: the key of the lp, or None if the lp can't be memoized (the reward is not a mixture of mdp.rFuncs)
+    """
+    if mdp.fingerprint is None or getattr(mdp, 'rFuncs', None) is None:
+      return None
+
+    # union of forbidden states, not indices of constraints
+    forbidden = frozenset(mdp.sIndex[s] for states in zeroConstraints for s in states)
+    goals = frozenset((mdp.sIndex[s], mdp.aIndex[a]) for s, a in positiveConstraints)
+    psi = tuple(round(prob, config.LP_CACHE_PSI_DECIMALS) for prob in mdp.psi)
+
+    return (mdp.fingerprint, forbidden, goals, positiveConstraintsOcc, psi)
+
+  def lookup(self, key, solve):
+    """
+    :param solve: a function that solves the lp, called when key is not memoized
+    :return: a shallow copy of the solution, so a caller that changes it doesn't change the memoized one
+    """
+    return dict(LRUCache.lookup(self, key, solve))
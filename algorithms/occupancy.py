@@ -0,0 +1,96 @@
+import numpy
+
+
+class Occupancy:
+  """
+  Occupancy measure of a policy, stored as a dense array x[s, a] indexed by the positions of states and actions in the
+  mdp (mdp.sIndex, mdp.aIndex).
+  It can still be read as the old {(s, a): occupancy} dict, e.g. pi[s, a], pi.keys() and pi.items().
+  """
+  def __init__(self, x, S, A, sIndex, aIndex):
+    """
+    :param x: occupancies of shape (|S|, |A|)
+    :param S, A, sIndex, aIndex: shared with the mdp, not copied
+    """
+    self.x = x
+    self.S = S
+    self.A = A
+    self.sIndex = sIndex
+    self.aIndex = aIndex
+
+  @classmethod
+  def fromDict(cls, pi, mdp):
+    """
+    convert a {(s, a): occupancy} dict on mdp to an Occupancy
+    """
+    x = numpy.array([[pi[s, a] for a in mdp.A] for s in mdp.S], dtype=float)
+    return cls(x, mdp.S, mdp.A, mdp.sIndex, mdp.aIndex)
+
+  def stateOccupancy(self):
+    """
+    :return: \\sum_a x[s, a] for all s
+    """
+    return self.x.sum(axis=1)
+
+  def dot(self, rVec):
+    """
+    :param rVec: rewards indexed in the same way as x (either of shape (|S|, |A|) or flattened)
+    :return: the value of this policy
+    """
+    return numpy.dot(self.x.ravel(), numpy.ravel(rVec))
+
+  def nonZeroItems(self):
+    """
+    :return: [((s, a), occupancy)] for all (s, a) with positive occupancies
+    """
+    sIndices, aIndices = numpy.nonzero(self.x)
+    return [((self.S[s], self.A[a]), self.x[s, a]) for s, a in zip(sIndices, aIndices)]
+
+  """
+  dict-compatible view, keys are (s, a) for all (s, a) in S x A
+  """
+  def __getitem__(self, key):
+    s, a = key
+    return self.x[self.sIndex[s], self.aIndex[a]]
+
+  def get(self, key, default=None):
+    return self[key] if key in self else default
+
+  def __contains__(self, key):
+    s, a = key
+    return s in self.sIndex and a in self.aIndex
+
+  def __len__(self):
+    return self.x.size
+
+  def __iter__(self):
+    # S may be appended with other states after x is computed, so only iterate the states in x
+    for s in range(self.x.shape[0]):
+      for a in range(self.x.shape[1]):
+        yield (self.S[s], self.A[a])
+
+  def keys(self):
+    return list(self)
+
+  def values(self):
+    return list(self.x.ravel())
+
+  def items(self):
+    return list(zip(self.keys(), self.values()))
+
+  def __eq__(self, other):
+    if isinstance(other, Occupancy):
+      return self.x.shape == other.x.shape and numpy.array_equal(self.x, other.x)
+    elif isinstance(other, dict):
+      return len(self) == len(other) and all(key in other and other[key] == value for key, value in self.items())
+    else:
+      return False
+
+  def __ne__(self, other):
+    return not self.__eq__(other)
+
+  # mutable, so not hashable (same as dict)
+  __hash__ = None
+
+  def __repr__(self):
+    return 'Occupancy(' + repr(dict(self.nonZeroItems())) + ')'
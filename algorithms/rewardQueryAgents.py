@@ -1,7 +1,8 @@
-import copy
+import numpy
 
 import config
-from algorithms.lp import lpDualGurobi, computeValue, milp, jointUncertaintyMilp
+from algorithms.lp import lpDualGurobi, computeValue, computeValues, computePolicyValue, milp, jointUncertaintyMilp
+from domains.domainConstructors import MDPView
 from util import computePosteriorBelief, printOccSA
 
 
@@ -19,8 +20,14 @@ class GreedyConstructRewardAgent:
     """
     compute the value of policy x. it computes the dot product between x and r
     """
-    if r is None: r = self.mdp.r
-    return computeValue(x, r, self.mdp.S, self.mdp.A)
+    if r is None: return computePolicyValue(x, self.mdp)
+    else: return computeValue(x, r, self.mdp.S, self.mdp.A)
+
+  def computeValues(self, q):
+    """
+    :return: values[piIdx, rewardIdx] of the policies in q under all reward candidates
+    """
+    return computeValues(q, self.mdp.getRewardTensor())
 
   def findPolicyQuery(self):
     # start with the prior optimal policy
@@ -38,7 +45,7 @@ class GreedyConstructRewardAgent:
 
   def findOptPolicyUnderMeanRewards(self, psi=None):
     if psi is not None:
-      mdp = copy.deepcopy(self.mdp)
+      mdp = MDPView(self.mdp)
       mdp.updatePsi(psi)
     else:
       # use the current psi
@@ -47,13 +54,11 @@ class GreedyConstructRewardAgent:
     return lpDualGurobi(mdp)['pi']
 
   def findNextPolicy(self, q):
-    maxV = []
-    rewardCandNum = len(self.mdp.psi)
-    for rewardIdx in xrange(rewardCandNum):
-      maxV.append(max([self.computeValue(pi, r=self.mdp.rFuncs[rewardIdx]) for pi in q]))
+    # maxV[rewardIdx] = max_{pi in q} V^pi_{r_rewardIdx}
+    maxV = self.computeValues(q).max(axis=0)
 
-    # solve a MILP problem
-    return milp(self.mdp, maxV)
+    # solve a MILP problem, warm-started with the last policy in q
+    return milp(self.mdp, maxV, start=q[-1])
 
   def findRewardSetQuery(self, qPi=None):
     """
@@ -63,11 +68,10 @@ class GreedyConstructRewardAgent:
     if qPi is None: qPi = self.findPolicyQuery()
 
     dominatingIndices = [[] for _ in qPi]
+    qPiValues = self.computeValues(qPi)
     for rewardIdx in range(len(self.mdp.psi)):
-      qPiValues = {piIdx: self.computeValue(qPi[piIdx], r=self.mdp.rFuncs[rewardIdx]) for piIdx in range(len(qPi))}
-      # print the current reward func index and the values of policies under this reward function for debugging
-
-      dominatingPi = max(qPiValues.keys(), key=lambda piIdx: qPiValues[piIdx])
+      # the first policy that has the highest value under this reward function
+      dominatingPi = numpy.argmax(qPiValues[:, rewardIdx])
       dominatingIndices[dominatingPi].append(rewardIdx)
 
     return dominatingIndices
@@ -79,12 +83,12 @@ class GreedyConstructRewardAgent:
     """
     if qR is None: qR = self.findRewardSetQuery(qPi)
 
-    ret = 0
-    for (pi, rs) in zip(qPi, qR):
-      for rIdx in rs:
-        piValue = self.computeValue(pi, self.mdp.rFuncs[rIdx])
+    qPiValues = self.computeValues(qPi)
 
-        ret += self.mdp.psi[rIdx] * piValue
+    ret = 0
+    for piIdx in range(len(qPi)):
+      for rIdx in qR[piIdx]:
+        ret += self.mdp.psi[rIdx] * qPiValues[piIdx, rIdx]
 
     return ret
 
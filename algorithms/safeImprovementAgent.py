@@ -1,3 +1,5 @@
+from __future__ import print_function
+
 import numpy
 
 from algorithms.consQueryAgents import ConsQueryAgent
@@ -49,8 +51,11 @@ class SafeImproveAgent(ConsQueryAgent):
     maxRegret = 0
     advPi = None
 
-    for pi in domPis:
-      humanViolated = self.findViolatedConstraints(pi)
+    # violated[i, idx] is True if domPis[i] violates the idx-th constraint
+    violated = self.findViolatedConstraintsOfPolicies(domPis)
+
+    for (pi, piViolated) in zip(domPis, violated):
+      humanViolated = [idx for idx in self.unknownCons if piViolated[idx]]
       humanValue = self.computeValue(pi)
 
       if consHuman and len(set(humanViolated).difference(tolerated)) > k:
@@ -66,8 +71,8 @@ class SafeImproveAgent(ConsQueryAgent):
 
       robotValue = -numpy.inf
       robotPi = None
-      for rPi in domPis:
-        if self.piSatisfiesCons(rPi, invarFeats):
+      for (rPi, rPiViolated) in zip(domPis, violated):
+        if not rPiViolated[list(invarFeats)].any():
           rValue = self.computeValue(rPi)
           if rValue > robotValue:
             robotValue = rValue
@@ -98,12 +103,12 @@ class SafeImproveAgent(ConsQueryAgent):
         mr, advPi = self.findMRAdvPi(q, relFeats, domPis, k)
         mrs[q] = mr
 
-        print q, 'mr', mr
+        print(q, 'mr', mr)
 
       if mrs == {}:
         mmq = () # no need to ask anything
       else:
-        mmq = min(mrs.keys(), key=lambda _: mrs[_])
+        mmq = min(mrs, key=lambda _: mrs[_])
 
       return mmq
 
@@ -156,12 +161,12 @@ class SafeImproveAgent(ConsQueryAgent):
             dominatedQ = True
             break
         if dominatedQ:
-          print q, 'is dominated'
+          print(q, 'is dominated')
           continue
 
       mr, advPi = self.findMRAdvPi(q, relFeats, domPis, k)
 
-      print q, mr
+      print(q, mr)
       #printOccSA(advPi) # for debug
 
       candQVCs[q] = self.findViolatedConstraints(advPi)
@@ -172,7 +177,7 @@ class SafeImproveAgent(ConsQueryAgent):
 
       mrs[q] = mr
 
-    mmq = min(mrs.keys(), key=lambda _: mrs[_])
+    mmq = min(mrs, key=lambda _: mrs[_])
 
     return mmq
 
@@ -187,7 +192,7 @@ class SafeImproveAgent(ConsQueryAgent):
         mr, advPi = self.findMRAdvPi(q, relFeats, domPis, k, consHuman=False)
 
       violatedCons = self.findViolatedConstraints(advPi)
-      print 'vio cons', violatedCons
+      print('vio cons', violatedCons)
 
       # we want to be careful about this, add unseen features to q
       # not disturbing the order of features in q
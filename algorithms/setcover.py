@@ -1,62 +1,95 @@
+"""
+Sets of features here are FeatureSets (bitmasks), so covering or removing a feature is a few integer operations.
+Lists or tuples of features are converted to FeatureSets.
+The set cover structures are Antichains, which are updated incrementally and count the sets that contain each feature.
+"""
+from algorithms.antichain import Antichain
+from algorithms.featureSet import FeatureSet, countSetsContainFeats
+
+
 def findHighestFrequencyElement(feats, sets, weight=lambda _: 1):
   """
   Here we want to use elements to cover sets.
   This function finds the element that appears in the most number of the sets.
 
-  sets: [[elements in one sets] for all sets]
+  sets: [FeatureSet of elements in one set for all sets]
   weights: find the element with the maximum weighted frequency. unweighted by default
   """
   if len(sets) == 0: return None
 
+  feats = list(feats)
+  if isinstance(sets, Antichain):
+    counts = list(map(sets.numOfSetsContainFeat, feats))
+  else:
+    counts = countSetsContainFeats(feats, list(map(FeatureSet.of, sets)))
+
   appearenceFreq = {}
   
-  for e in feats:
-    appearenceFreq[e] = weight(e) * sum(e in s for s in sets)
+  for e, count in zip(feats, counts):
+    appearenceFreq[e] = weight(e) * count
   
   # return the index of the element that has the most appearances
-  return max(appearenceFreq.iteritems(), key=lambda _: _[1])[0]
+  return max(appearenceFreq.items(), key=lambda _: _[1])[0]
   
+def toAntichain(sets):
+  """
+  :return: a new Antichain of sets, which is a copy if sets is an Antichain
+  """
+  if isinstance(sets, Antichain):
+    return sets.copy()
+  else:
+    return Antichain(sets)
+
 def coverFeat(feat, sets):
   """
   Find the new set of sets if feat is covered.
   We only need to remove the sets that contain feat.
+  sets is not changed. Use Antichain.coverFeat to update an Antichain in place.
   """
-  return filter(lambda s: feat not in s, sets)
+  if isinstance(sets, Antichain):
+    newSets = sets.copy()
+    newSets.coverFeat(feat)
+    return newSets
+  else:
+    return [s for s in map(FeatureSet.of, sets) if feat not in s]
 
 def removeFeat(feat, sets):
   """
   Find the new set of sets if feat is removed.
   We remove feat, and remove sets that are reducible (which are supersets of any other set).
+  sets is not changed. Use Antichain.removeFeat to update an Antichain in place.
   """
-  newSets = map(lambda s: tuple(set(s) - {feat}), sets)
-  # kill duplicates
-  newSets = list(set(newSets))
-  # kill supersets
-  newSets = filter(lambda s: not any(set(otherSet).issubset(s) for otherSet in newSets if otherSet != s), newSets)
-
-  return map(lambda s: tuple(s), newSets)
+  newSets = toAntichain(sets)
+  if feat is not None: newSets.removeFeat(feat)
+  return newSets
 
 def killSupersets(sets):
   """
-  A hacky way to remove sets that are supersets of others.
+  Remove sets that are supersets of others.
   
   {{1}, {1, 2}} --> {{1}}
   """
-  return removeFeat(None, sets)
+  return Antichain(sets)
 
 def leastNumElemSetsWithoutFeat(feat, sets):
   """
   Find the smallest set that contains feat and return the size when feat is removed.
   """
-  setsWithoutFeat = map(lambda s: set(s) - {feat}, sets)
+  setsWithoutFeat = [s.remove(feat) for s in map(FeatureSet.of, sets)]
   minSizedSet = min(setsWithoutFeat, key=lambda s: len(s))
   return minSizedSet
 
 def numOfSetsContainFeat(feat, sets):
-  return sum(feat in s for s in sets)
+  if isinstance(sets, Antichain):
+    return sets.numOfSetsContainFeat(feat)
+  else:
+    return int(countSetsContainFeats([feat], list(map(FeatureSet.of, sets)))[0])
 
 def elementExists(feat, sets):
-  return any(feat in s for s in sets)
+  if isinstance(sets, Antichain):
+    return sets.numOfSetsContainFeat(feat) > 0
+  else:
+    return any(feat in s for s in sets)
 
 """
 DEPRECATED look at the dual form of the set, not in this way..
@@ -73,4 +106,4 @@ def findElementThatRemovesMostSets(feats, sets, admissibleProbs):
   for e in feats:
     expectNumRemainingSets[e] = admissibleProbs[e] * len(coverFeat(e, sets)) + (1 - admissibleProbs[e]) * len(removeFeat(e, sets))
     
-  return min(expectNumRemainingSets.iteritems(), key=lambda _: _[1])[0]
+  return min(expectNumRemainingSets.items(), key=lambda _: _[1])[0]
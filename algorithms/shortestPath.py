@@ -0,0 +1,109 @@
+"""
+Shortest-path solver for deterministic mdps where the robot is rewarded once and then the episode ends,
+e.g. officeNavigationTask, where a switch is turned off and the robot stops there.
+Then the (safely-)optimal policy follows a shortest path to the (s, a) with the largest discounted reward.
+"""
+import numpy
+
+from algorithms.dynamicProgramming import forbiddenStates, solvePolicyIteration
+from algorithms.lp import compileMDP, solutionCache, toOccupancy
+
+
+def isShortestPathProblem(mdp):
+  """
+  :return: True if mdp is deterministic, starts from one state, and its rewards are nonnegative and only given by
+    actions that end the episode. mdp should be compiled.
+  """
+  transitions = mdp.transitionMatrix
+  r = mdp.getRewardVector()
+
+  # one next state for each (s, a). the next states of terminal states may not be in the mdp
+  nextStateNums = numpy.diff(transitions.indptr)
+  nonTerminalSA = numpy.repeat(mdp.nonTerminal, len(mdp.A))
+  deterministic = (nextStateNums[nonTerminalSA] == 1).all() and (nextStateNums <= 1).all() and \
+                  (transitions.data == 1).all()
+  if not deterministic or mdp.gamma >= 1 or (mdp.alphaVec > 0).sum() != 1:
+    return False
+
+  # rewarding (s, a) should lead from a non-terminal state to a terminal state
+  endsEpisode = (transitions.dot((~mdp.nonTerminal).astype(float)) == 1) & nonTerminalSA
+  return (r >= 0).all() and (endsEpisode | (r == 0)).all()
+
+def shortestPathOptPi(mdp, zeroConstraints=()):
+  """
+  Same as lpDualGurobi(mdp, zeroConstraints) when isShortestPathProblem(mdp).
+
+  :return: {'feasible': if a safe policy exists,
+            'obj': the value of the optimal safe policy,
+            'pi': its occupancy measure}
+  """
+  compileMDP(mdp)
+
+  key = solutionCache.makeKey(mdp, zeroConstraints)
+  return solutionCache.lookup(key, lambda: solveShortestPath(mdp, zeroConstraints))
+
+def findShortestPaths(mdp, forbidden):
+  """
+  Breadth-first search from the initial state, without visiting forbidden states.
+  Flow leaves non-terminal states only.
+
+  :return: (dist, parent), dist[s] is the number of steps to reach s, -1 if s is not reachable.
+    parent[s] is the index (s' * |A| + a') of the state and action that reach s on a shortest path.
+  """
+  aLen = len(mdp.A)
+  transitionsTo = mdp.transitionMatrix.T.tocsr()
+
+  dist = numpy.full(len(mdp.S), -1, dtype=int)
+  parent = numpy.full(len(mdp.S), -1, dtype=int)
+
+  frontier = (mdp.alphaVec > 0) & ~forbidden
+  dist[frontier] = 0
+  step = 0
+  while frontier.any():
+    step += 1
+
+    # incoming[s', (s, a)] is nonzero if (s, a) in the frontier reaches s'
+    flow = numpy.repeat(frontier & mdp.nonTerminal, aLen).astype(float)
+    incoming = transitionsTo.multiply(flow).tocsr()
+    incoming.eliminate_zeros()
+    incoming.sort_indices()
+
+    frontier = (numpy.diff(incoming.indptr) > 0) & (dist < 0) & ~forbidden
+    newStates = numpy.nonzero(frontier)[0]
+    dist[newStates] = step
+    # the first (s, a) that reaches each new state
+    parent[newStates] = incoming.indices[incoming.indptr[newStates]]
+
+  return dist, parent
+
+def solveShortestPath(mdp, zeroConstraints=()):
+  """
+  shortestPathOptPi without memoization.
+  """
+  aLen = len(mdp.A)
+  gamma = mdp.gamma
+  r = mdp.getRewardVector()
+
+  forbidden = forbiddenStates(mdp, zeroConstraints)
+  dist, parent = findShortestPaths(mdp, forbidden)
+
+  # discounted rewards of (s, a) that can be reached
+  states = numpy.repeat(numpy.arange(len(mdp.S)), aLen)
+  reachable = (dist[states] >= 0) & (r > 0)
+
+  if not reachable.any():
+    # no reward can be collected, so any safe policy is optimal. let policy iteration find one
+    return solvePolicyIteration(mdp, zeroConstraints)
+
+  values = numpy.where(reachable, gamma ** numpy.maximum(dist[states], 0) * r, -numpy.inf)
+  goal = numpy.argmax(values)
+
+  # the occupancy of the t-th (s, a) on the path is gamma^t
+  x = numpy.zeros(len(mdp.S) * aLen)
+  x[goal] = gamma ** dist[goal // aLen]
+  s = goal // aLen
+  while dist[s] > 0:
+    x[parent[s]] = gamma ** (dist[s] - 1)
+    s = parent[s] // aLen
+
+  return {'feasible': True, 'obj': values[goal], 'pi': toOccupancy(mdp, x)}
@@ -0,0 +1,86 @@
+"""
+Enumerating subsets of a growing set of features, used by ConsQueryAgent.findRelevantFeaturesAndDomPis.
+Subsets of features are FeatureSets.
+"""
+import heapq
+
+from algorithms.featureSet import FeatureSet
+
+
+class SubsetFrontier:
+  """
+  Subsets of a set of features that is growing, popped from the smallest to the largest.
+  The order of the subsets of the same size is by their sorted features.
+
+  Each subset is pushed by extending a popped subset with one feature added after the features in it, so a subset is
+  only pushed when its subsets without that feature are popped, and each subset is pushed once.
+  """
+  def __init__(self):
+    # features in the order they are added
+    self.feats = []
+    self.ranks = {}
+
+    # heap of (size, features, mask)
+    self.heap = [(0, [], FeatureSet(0))]
+    self.popped = []
+
+  def push(self, mask):
+    feats = list(mask)
+    heapq.heappush(self.heap, (len(feats), feats, mask))
+
+  def addFeat(self, feat):
+    """
+    Add feat to the set of features. The subsets with feat are extended from the subsets that are already popped.
+    The subsets in the frontier are extended with feat when they are popped.
+    """
+    if feat in self.ranks: return
+
+    self.ranks[feat] = len(self.feats)
+    self.feats.append(feat)
+
+    for mask in self.popped:
+      self.push(mask.add(feat))
+
+  def pop(self):
+    """
+    :return: the next subset, None if all subsets are popped
+    """
+    if len(self.heap) == 0: return None
+
+    (_, feats, mask) = heapq.heappop(self.heap)
+    self.popped.append(mask)
+
+    # extend with the features added after all features in this subset
+    lastRank = max([self.ranks[feat] for feat in feats] + [-1])
+    for feat in self.feats[lastRank + 1:]:
+      self.push(mask.add(feat))
+
+    return mask
+
+
+class PruningRules:
+  """
+  The beta rules in the DomPolicies algorithm. A rule (enforced, relaxed) prunes the subsets of constraints that
+  include enforced and exclude relaxed.
+  Rules are indexed by relaxed, and only the minimal enforced masks are kept for each relaxed mask,
+  since a rule with a larger enforced mask prunes fewer subsets.
+  """
+  def __init__(self):
+    # relaxed -> [enforced]
+    self.rules = {}
+
+  def add(self, enforced, relaxed):
+    enforcedMasks = self.rules.setdefault(relaxed, [])
+    if any(mask & ~enforced == 0 for mask in enforcedMasks):
+      # pruned by an existing rule already
+      return
+    enforcedMasks[:] = [mask for mask in enforcedMasks if enforced & ~mask != 0] + [enforced]
+
+  def prunes(self, mask):
+    """
+    :return: True if some rule prunes the subset mask
+    """
+    for relaxed, enforcedMasks in self.rules.items():
+      if relaxed & mask == 0 and any(enforced & ~mask == 0 for enforced in enforcedMasks):
+        return True
+    return False
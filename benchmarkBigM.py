@@ -0,0 +1,112 @@
+"""
+Compare the tight big-M formulation of the query milps (config.BIG_M = None) with the old one (config.BIG_M = 10000).
+
+For each random domain, it finds the policy queries of the reward query agent (milp) and of the batch query agent
+(lpDualGurobi with unknown features and jointUncertaintyMilp), and reports the number of branch-and-bound nodes and the
+solving time of the milps under each formulation.
+
+usage: python benchmarkBigM.py [-n numOfCarpets] [-s numOfSwitches] [-r seed] [-t numOfTrials]
+"""
+from __future__ import print_function
+
+import copy
+import getopt
+import random
+import sys
+
+import numpy
+
+import config
+from algorithms import lp
+from algorithms.jointUncertaintyBatchQueryAgent import JointUncertaintyBatchQueryAgent
+from algorithms.rewardQueryAgents import GreedyConstructRewardAgent
+from domains.officeNavigation import officeNavigationTask, squareWorld
+from util import normalize
+
+formulations = [('M = 10000', 10000), ('tight M', None)]
+
+def findQueries(mdp, consStates, consProbs, costOfQuery):
+  """
+  :return: values of the policies in the queries found by the agents, to make sure both formulations agree
+  """
+  rewardAgent = GreedyConstructRewardAgent(copy.deepcopy(mdp), k=2)
+  q = rewardAgent.findPolicyQuery()
+  values = list(rewardAgent.computeValues(q).ravel())
+
+  batchAgent = JointUncertaintyBatchQueryAgent(copy.deepcopy(mdp), consStates, consProbs=consProbs,
+                                               costOfQuery=costOfQuery, qi=False)
+  batchAgent.encodeConstraintIntoTransition(batchAgent.mdp)
+  q = batchAgent.findPolicyQuery()
+  values += list(batchAgent.computeValues(q).ravel())
+
+  return values
+
+def benchmark(mdp, consStates, consProbs, costOfQuery):
+  """
+  :return: {formulation name: (values of queries, mip statistics)}
+  """
+  results = {}
+  for (name, M) in formulations:
+    config.BIG_M = M
+    # don't reuse solutions found by the other formulation
+    lp.solutionCache.clear()
+    lp.resetMIPStats()
+
+    values = findQueries(mdp, consStates, consProbs, costOfQuery)
+    results[name] = (values, dict(lp.mipStats))
+
+  return results
+
+
+if __name__ == '__main__':
+  from config import size, walls
+
+  numOfCarpets = 4
+  numOfSwitches = 2
+  rnd = 0
+  numOfTrials = 5
+  costOfQuery = 0.1
+
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], 'n:s:r:t:')
+  except getopt.GetoptError:
+    raise Exception('Unknown flag')
+  for opt, arg in opts:
+    if opt == '-n':
+      numOfCarpets = int(arg)
+    elif opt == '-s':
+      numOfSwitches = int(arg)
+    elif opt == '-r':
+      rnd = int(arg)
+    elif opt == '-t':
+      numOfTrials = int(arg)
+    else:
+      raise Exception('unknown argument')
+
+  total = {name: {'solves': 0, 'nodes': 0, 'time': 0.0} for (name, _) in formulations}
+
+  for trial in range(rnd, rnd + numOfTrials):
+    random.seed(trial)
+    numpy.random.seed(trial)
+
+    spec = squareWorld(size=size, numOfCarpets=numOfCarpets, numOfWalls=walls, numOfSwitches=numOfSwitches)
+    rewardProbs = normalize([random.random() for _ in range(numOfSwitches)])
+    mdp, consStates, goalStates = officeNavigationTask(spec, rewardProbs=rewardProbs, gamma=0.99)
+    consProbs = [random.random() for _ in range(len(consStates))]
+
+    results = benchmark(mdp, consStates, consProbs, costOfQuery)
+
+    for (name, _) in formulations:
+      (values, stats) = results[name]
+      print('seed', trial, name, 'solves', stats['solves'], 'nodes', stats['nodes'], 'time', stats['time'])
+      for key in stats:
+        total[name][key] += stats[key]
+
+    # both formulations should find queries of the same values
+    (oldValues, _) = results[formulations[0][0]]
+    (newValues, _) = results[formulations[1][0]]
+    if not numpy.allclose(oldValues, newValues, atol=1e-4):
+      print('seed', trial, 'values differ', oldValues, newValues)
+
+  for (name, _) in formulations:
+    print('total', name, 'solves', total[name]['solves'], 'nodes', total[name]['nodes'], 'time', total[name]['time'])
@@ -3,10 +3,42 @@ DEBUG = False
 
 OPT_METHOD = 'gurobi'
 #OPT_METHOD = 'cplex'
+# open-source HiGHS solver in scipy, for machines without gurobi licenses.
+# it needs scipy >= 1.9, so run on Python 3
+#OPT_METHOD = 'highs'
+
+# max number of constrained lp solutions to memoize (0 to disable)
+LP_CACHE_SIZE = 1000
+# psi is rounded to these decimals when looking up memoized solutions
+LP_CACHE_PSI_DECIMALS = 8
+
+# max number of transition matrices with constraints encoded (by JointUncertaintyQueryAgent) to memoize
+ENCODED_TRANSITION_CACHE_SIZE = 100
+
+# max number of lp sessions (solver models of different mdp structures) to keep, see algorithms/lp.py
+LP_SESSION_CACHE_SIZE = 10
+
+# a policy visits a state if the occupancy of the state is larger than this (e.g. to ignore numerical errors)
+OCCUPANCY_TOLERANCE = 0
+
+# big-M of the indicator constraints in milps. None to derive the smallest valid ones from the mdp,
+# e.g. occupancies are bounded by 1 / (1 - gamma). 10000 is the old formulation
+BIG_M = None
+
+# solve constrained problems with only states to avoid (no goal constraints) by policy iteration instead of lps
+USE_DP = True
+
+# directory of compiled mdps shared by runs and parallel workers (see domains/mdpCache.py). None to disable
+MDP_CACHE_DIR = None
 
 # make this smaller because we need to find dom pis for 2^|\R| times in joint uncertainty works
 earlyStop = 1
 
+# only find iiss with at most this many features, and stop enumerating iiss after this many seconds (see
+# algorithms/hittingSets.py). None for no caps
+IIS_MAX_SIZE = None
+IIS_TIME_LIMIT = None
+
 # for each domain configuration, sample the true reward function and the true free features
 #sampleInstances = 20
 
@@ -1,4 +1,9 @@
 import copy
+import hashlib
+import numbers
+
+import numpy
+from scipy import sparse
 
 from util import normalize
 
@@ -13,14 +18,35 @@ class SimpleMDP:
     self.S = S
     self.A = A
     self.T = T
+    self.resetCompiled()
     if r is not None: self.setReward(r)
     self.alpha = alpha
     self.terminal = terminal
     self.gamma = gamma
 
-    # can compute this to make lp more efficient
+    # deterministic transitions, can compute these to make lp more efficient
+    # transit(s, a) -> s', and nextState[sIndex[s], aIndex[a]] = sIndex[s']
     self.transit = None
-    self.invertT = None
+    self.nextState = None
+    # sparse transition probabilities, transitionProbs[s * |A| + a, s'] = T(s, a, s'), used instead of T if given
+    self.transitionProbs = None
+
+  def resetCompiled(self):
+    """
+    Clear the structures compiled from S, T, terminal, alpha and rewards. They are recomputed lazily.
+    Call this after changing any of them in place.
+    """
+    # compiled constraints for lp, computed by computeFlowMatrix and computeInitialDistribution
+    self.transitionMatrix = None
+    self.flowMatrix = None
+    self.nonTerminal = None
+    self.successors = None
+    self.alphaVec = None
+    # hash of the compiled mdp, computed by computeFingerprint
+    self.fingerprint = None
+    # compiled rewards, computed by getRewardTensor and getRewardVector
+    self.rewardTensor = None
+    self.rewardVec = None
 
   def setReward(self, rInput):
     """
@@ -28,22 +54,52 @@ class SimpleMDP:
     """
     if callable(rInput):
       self.r = rInput
+      self.rewardVec = None
     elif type(rInput) is list:
-      self.rFuncs = map(lambda _: _[0], rInput)
-      psi = map(lambda _: _[1], rInput)
+      self.rFuncs = [_[0] for _ in rInput]
+      psi = [_[1] for _ in rInput]
       self.updatePsi(psi)
     else:
       raise Exception('unknown type of reward')
 
   def updatePsi(self, psi):
     self.psi = normalize(psi)
-    self.r = lambda s, a: sum(rFunc(s, a) * prob for (rFunc, prob) in zip(self.rFuncs, self.psi))
+    # a bound method, so copies of this mdp use their own psi
+    self.r = self.meanReward
+    self.rewardVec = None
+
+  def meanReward(self, s, a):
+    return sum(rFunc(s, a) * prob for (rFunc, prob) in zip(self.rFuncs, self.psi))
+
+  def getRewardTensor(self):
+    """
+    Compile rFuncs once into a sparse matrix, where rewardTensor[i, s * |A| + a] = rFuncs[i](s, a).
+    Rewards in our domains are nonzero only in a few (s, a).
+    """
+    if self.rewardTensor is None:
+      self.rewardTensor = sparse.csr_matrix(numpy.array([[rFunc(s, a) for s in self.S for a in self.A]
+                                                         for rFunc in self.rFuncs], dtype=float))
+    return self.rewardTensor
+
+  def getRewardVector(self):
+    """
+    :return: the reward r(s, a) for all (s, a), indexed by s * |A| + a.
+      this is psi^T rewardTensor if the reward is uncertain
+    """
+    if self.rewardVec is None:
+      if hasattr(self, 'rFuncs'):
+        self.rewardVec = self.getRewardTensor().T.dot(numpy.array(self.psi, dtype=float))
+      else:
+        self.rewardVec = numpy.array([self.r(s, a) for s in self.S for a in self.A], dtype=float)
+    return self.rewardVec
 
   def resetInitialState(self, initS):
     """
     reset the initial state distribution to be deterministically starting from initS
     """
     self.alpha = lambda s: s == initS
+    self.alphaVec = None
+    self.fingerprint = None
 
   def computeTUsingTransit(self):
     """
@@ -51,46 +107,381 @@ class SimpleMDP:
     """
     self.T = lambda state, action, sp: 1 if sp == self.transit(state, action) else 0
 
-  def computeInvertT(self):
-    # in the flow conservation constraints in lp, we need to find out what s, a can reach sp
-    # so we precompute the inverted transition function here to save time in solving lp
-    self.invertT = {}
+  def computeIndices(self):
+    """
+    map states and actions to their positions in S and A, so we don't need to call S.index or A.index
+    """
+    self.sIndex = {s: idx for idx, s in enumerate(self.S)}
+    self.aIndex = {a: idx for idx, a in enumerate(self.A)}
+
+  def computeFlowMatrix(self):
+    """
+    Compile the transition function into a sparse matrix, transitionMatrix[s * |A| + a, s'] = T(s, a, s'),
+    and the flow conservation constraints of lp, so that lp does not call T for every (s, a, s').
+    The column of (s, a) is s * |A| + a.
+
+    flowMatrix[s', (s, a)] = 1_{s = s'} - \gamma * T(s, a, s')
+    """
+    self.computeIndices()
+
+    sLen = len(self.S)
+    aLen = len(self.A)
+
+    # supports of T(s, a, s')
+    rows = []
+    cols = []
+    probs = []
+    if self.transitionProbs is not None:
+      entries = self.transitionProbs.tocoo()
+      rows = entries.row
+      cols = entries.col
+      probs = entries.data
+    elif self.nextState is not None:
+      # deterministic transitions in a table, -1 if the next state is not in S
+      nextStates = self.nextState.ravel()
+      rows = numpy.nonzero(nextStates >= 0)[0]
+      cols = nextStates[rows]
+      probs = numpy.ones(len(rows))
+    elif self.transit is not None:
+      # deterministic transitions, only one s' for each (s, a)
+      for s in range(sLen):
+        for a in range(aLen):
+          # the next state of a terminal state may not be reachable, in which case there is no flow
+          sp = self.sIndex.get(self.transit(self.S[s], self.A[a]))
+          if sp is not None:
+            rows.append(s * aLen + a)
+            cols.append(sp)
+            probs.append(1.0)
+    else:
+      # the normal way, need to iterate over all (s, a, s')
+      for s in range(sLen):
+        for a in range(aLen):
+          for sp in range(sLen):
+            prob = self.T(self.S[s], self.A[a], self.S[sp])
+            if prob != 0:
+              rows.append(s * aLen + a)
+              cols.append(sp)
+              probs.append(prob)
+
+    self.transitionMatrix = sparse.csr_matrix((probs, (rows, cols)), shape=(sLen * aLen, sLen))
+
+    # actionsOfStates[s, (s, a)] = 1 for all a, the supports of 1_{s = s'}
+    actionsOfStates = sparse.kron(sparse.identity(sLen), numpy.ones((1, aLen))).tocsr()
+    self.flowMatrix = (actionsOfStates - self.gamma * self.transitionMatrix.T).tocsr()
+    self.nonTerminal = numpy.array([not self.terminal(s) for s in self.S])
+
+    # successors[s, s'] is nonzero if s' can be reached from s in one step by some action
+    self.successors = actionsOfStates.dot(self.transitionMatrix).tocsr()
+
+  def computeInitialDistribution(self):
+    self.alphaVec = numpy.array([self.alpha(s) for s in self.S], dtype=float)
+
+  def computeFingerprint(self):
+    """
+    Hash the orders of states and actions, the compiled transitions, initial distribution and reward candidates.
+    Copies of the same mdp have the same fingerprint, so they can share lp solutions.
+    The orders are hashed since cached solutions are indexed by them.
+    Needs computeFlowMatrix and computeInitialDistribution first.
+    """
+    h = hashlib.sha1()
+    h.update(repr((self.S, self.A)).encode('utf-8'))
+    for arr in [self.flowMatrix.indptr, self.flowMatrix.indices, self.flowMatrix.data, self.nonTerminal, self.alphaVec]:
+      h.update(numpy.ascontiguousarray(arr).tobytes())
+
+    if hasattr(self, 'rFuncs'):
+      rewardTensor = self.getRewardTensor()
+      for arr in [rewardTensor.indptr, rewardTensor.indices, rewardTensor.data]:
+        h.update(numpy.ascontiguousarray(arr).tobytes())
+
+    self.fingerprint = h.hexdigest()
+
+
+class MDPView(SimpleMDP):
+  """
+  A copy-on-write view of an mdp.
+  Reading an attribute falls back to the base mdp, while setting one (e.g. by updatePsi, or replacing S, T or terminal)
+  only changes the view. So S, the closures and the compiled structures are shared instead of deep-copied, and a view
+  is created in constant time and memory.
+  Attributes of the base should not be changed in place through the view, e.g. use view.S = view.S + [s] rather than
+  view.S.append(s).
+  """
+  def __init__(self, base):
+    self.base = base
+
+  def __getattr__(self, name):
+    # only called when name is not set on the view. base is checked to avoid recursion before it is set (e.g. copying)
+    if name == 'base':
+      raise AttributeError(name)
+    return getattr(self.base, name)
+
+
+class StateConstraints:
+  """
+  Constraints of not visiting some states, represented by a sparse incidence matrix over S.
+  incidence[idx, s] is True if S[s] violates the idx-th constraint, and masks[s] is the bitmask of the constraints that
+  S[s] violates (the idx-th bit for the idx-th constraint).
+
+  It can be used as the list [[states that violate the idx-th constraint] for all idx]. The lists of states are only
+  created when they are read.
+  """
+  def __init__(self, S, incidence):
+    self.S = S
+    self.incidence = sparse.csr_matrix(incidence, dtype=bool)
+    self.incidence.sort_indices()
+
+    self.masks = numpy.zeros(len(S), dtype=object)
+    for idx in range(len(self)):
+      self.masks[self.stateIndices(idx)] |= 1 << idx
+
+    # idx -> [states that violate the idx-th constraint]
+    self.stateLists = {}
+
+  @classmethod
+  def fromLists(cls, S, consStates):
+    """
+    :param consStates: [[states that violate the idx-th constraint] for all idx]
+    """
+    sIndex = {s: idx for idx, s in enumerate(S)}
+    rows = [idx for idx in range(len(consStates)) for _ in consStates[idx]]
+    cols = [sIndex[s] for states in consStates for s in states]
+    incidence = sparse.csr_matrix((numpy.ones(len(rows), dtype=bool), (rows, cols)), shape=(len(consStates), len(S)))
+    return cls(S, incidence)
+
+  def stateIndices(self, idx):
+    """
+    :return: indices in S of the states that violate the idx-th constraint
+    """
+    return self.incidence.indices[self.incidence.indptr[idx]:self.incidence.indptr[idx + 1]]
+
+  def constraintsOf(self, sIdx):
+    """
+    :return: the bitmask of the constraints that S[sIdx] violates
+    """
+    return self.masks[sIdx]
+
+  def __len__(self):
+    return self.incidence.shape[0]
+
+  def __getitem__(self, idx):
+    if isinstance(idx, slice):
+      return [self[i] for i in range(len(self))[idx]]
+    if idx < 0:
+      idx += len(self)
+    if not 0 <= idx < len(self):
+      raise IndexError('constraint index out of range')
+
+    if idx not in self.stateLists:
+      self.stateLists[idx] = [self.S[sIdx] for sIdx in self.stateIndices(idx)]
+    return self.stateLists[idx]
+
+  def __iter__(self):
+    for idx in range(len(self)):
+      yield self[idx]
+
 
-    for s in self.S:
-      self.invertT[s] = []
+class FactoredStateEncoder:
+  """
+  Encode factored states as mixed-radix integers.
+  The i-th component of a state takes values in sSets[i], and the code of state s is
+  \sum_i (index of s[i] in sSets[i]) * \prod_{j > i} |sSets[j]|
+  """
+  def __init__(self, sSets):
+    self.sSets = [list(values) for values in sSets]
+    # value -> its index in the factor domain
+    self.valueIndices = [{value: idx for idx, value in enumerate(values)} for values in self.sSets]
+
+    self.radices = numpy.array([len(values) for values in self.sSets], dtype=numpy.int64)
+    # the last component changes the fastest
+    self.placeValues = numpy.append(numpy.cumprod(self.radices[:0:-1])[::-1], 1).astype(numpy.int64)
+    # python ints, for encoding and decoding one state at a time
+    self.places = self.placeValues.tolist()
+    self.size = int(numpy.prod(self.radices))
+
+  def factorIndices(self, states):
+    """
+    :return: an int array of shape (len(states), number of factors)
+    """
+    return numpy.array([[self.valueIndices[i][s[i]] for i in range(len(self.sSets))] for s in states],
+                       dtype=numpy.int64).reshape(len(states), len(self.sSets))
+
+  def encodeFactorIndices(self, indices):
+    """
+    :param indices: an int array of shape (number of states, number of factors)
+    :return: codes of the rows of indices, -1 for rows with indices out of the factor domains
+    """
+    valid = ((indices >= 0) & (indices < self.radices)).all(axis=1)
+    return numpy.where(valid, indices.dot(self.placeValues), -1)
+
+  def encode(self, s):
+    return sum(indices[value] * place for indices, value, place in zip(self.valueIndices, s, self.places))
+
+  def encodeAll(self, states):
+    return self.factorIndices(states).dot(self.placeValues)
+
+  def decodeFactorIndices(self, codes):
+    """
+    inverse of factorIndices(states).dot(placeValues), vectorized over codes
+    """
+    return (numpy.asarray(codes, dtype=numpy.int64)[:, None] // self.placeValues) % self.radices
 
-    for s in self.S:
-      if not self.terminal(s):
-        for a in self.A:
-          sp = self.transit(s, a)
-          self.invertT[sp].append((s, a))
+  def decode(self, code):
+    return tuple(values[(code // place) % len(values)] for values, place in zip(self.sSets, self.places))
 
 
 class DeterministicFactoredMDP(SimpleMDP):
-  def __init__(self, sSets, aSets, rFunc, tFunc, s0, gamma=1, terminal=lambda s: False):
-    SimpleMDP.__init__(self, A=aSets, r=rFunc, alpha=lambda s: s == s0, terminal=terminal, gamma=gamma)
+  def __init__(self, sSets, aSets, rFunc, tFunc, s0, gamma=1, terminal=lambda s: False,
+               transitionKernel=None, terminalKernel=None, compiled=None):
+    """
+    States are the mixed-radix codes of the factored states (see FactoredStateEncoder), so S, sIndex, occupancies and
+    constraints only keep integers. rFunc, tFunc, s0 and terminal are defined on factored states (tuples), and they are
+    wrapped to work on codes. Use decodeState to get the factored state, e.g. for printing.
+
+    transitionKernel and terminalKernel are optional vectorized versions of tFunc and terminal, which work on indices
+    of factor values of many states at once.
+    transitionKernel(F, aIdx) -> F', where F'[i] is the next state of F[i] by action aSets[aIdx]
+    terminalKernel(F) -> a bool array, terminal states in F
+    If they are provided, S and nextState are computed by them. Otherwise the closures are called for each state.
+
+    compiled: arrays returned by compiledArrays() of the same mdp (e.g. loaded from domains.mdpCache), so the states
+    are not explored again
+    """
+    self.encoder = FactoredStateEncoder(sSets)
+    decode = self.decodeState
+    s0Code = self.encoder.encode(s0)
+
+    def onCodes(f):
+      return lambda s, a: f(decode(s), a)
+
+    if callable(rFunc):
+      rFunc = onCodes(rFunc)
+    else:
+      rFunc = [(onCodes(f), prob) for (f, prob) in rFunc]
 
-    # transit(s, a) -> s'
+    SimpleMDP.__init__(self, A=aSets, r=rFunc, alpha=lambda s: s == s0Code, terminal=lambda s: terminal(decode(s)),
+                       gamma=gamma)
+
+    # transit(s, a) -> s', on factored states
     # the i-th component of s' is determined by tFunc[i]
-    self.transit = lambda state, action: tuple([t(state, action) for t in tFunc])
-
-    # construct the set of reachable states
-    self.S = []
-    buffer = [s0]
-    # stop when no new states are found by one-step transitions
-    while len(buffer) > 0:
-      # add the last batch to S
-      self.S += buffer
-      newBuffer = []
-      for s in buffer:
-        if not terminal(s):
-          for a in aSets:
-            sp = self.transit(s, a)
-            if not sp in self.S and not sp in newBuffer:
-              newBuffer.append(sp)
-      buffer = newBuffer
+    transit = lambda state, action: tuple([t(state, action) for t in tFunc])
+    self.transit = lambda s, a: self.encoder.encode(transit(decode(s), a))
+
+    if compiled is not None:
+      self.loadCompiledArrays(compiled)
+    elif transitionKernel is not None and terminalKernel is not None:
+      self.exploreByKernels(s0Code, transitionKernel, terminalKernel)
+    else:
+      self.exploreByTransit(s0, transit, terminal)
 
     # T(s, a, sp) -> prob
     self.computeTUsingTransit()
-    # to make lp more efficient
-    self.computeInvertT()
+
+  def decodeState(self, s):
+    """
+    :return: the factored state of code s. States that are not codes (e.g. a sink added by agents) are returned as is
+    """
+    if isinstance(s, numbers.Integral):
+      return self.encoder.decode(s)
+    else:
+      return s
+
+  def exploreByTransit(self, s0, transit, terminal):
+    """
+    Construct the set of reachable states by breadth-first search on factored states.
+    States are indexed by the order they are found, sIndex maps them back to their indices.
+    """
+    states = [s0]
+    indices = {s0: 0}
+    successors = {}
+    idx = 0
+    while idx < len(states):
+      s = states[idx]
+      if not terminal(s):
+        successors[idx] = [transit(s, a) for a in self.A]
+        for sp in successors[idx]:
+          if sp not in indices:
+            indices[sp] = len(states)
+            states.append(sp)
+      idx += 1
+
+    # the next states of terminal states are not expanded, so they may not be in S (-1)
+    self.nextState = numpy.empty((len(states), len(self.A)), dtype=numpy.int32)
+    for idx in range(len(states)):
+      sps = successors[idx] if idx in successors else [transit(states[idx], a) for a in self.A]
+      self.nextState[idx] = [indices.get(sp, -1) for sp in sps]
+
+    self.setStateCodes(self.encoder.encodeAll(states))
+
+  def exploreByKernels(self, s0, transitionKernel, terminalKernel):
+    """
+    Same as exploreByTransit, but expands a whole layer of the breadth-first search at a time.
+    States are found in the same order as exploreByTransit.
+
+    :param s0: the code of the initial state
+    """
+    encoder = self.encoder
+    aLen = len(self.A)
+
+    seen = numpy.array([s0], dtype=numpy.int64)
+    frontier = seen
+    while len(frontier) > 0:
+      F = encoder.decodeFactorIndices(frontier)
+      F = F[~terminalKernel(F)]
+
+      # codes of the next states, in the order of (state, action)
+      spCodes = numpy.column_stack([encoder.encodeFactorIndices(transitionKernel(F, aIdx)) for aIdx in range(aLen)])
+      spCodes = spCodes.ravel()
+      spCodes = spCodes[spCodes >= 0]
+
+      # new states in the order they are first found
+      uniqueCodes, firstIndices = numpy.unique(spCodes, return_index=True)
+      uniqueCodes = uniqueCodes[numpy.argsort(firstIndices)]
+      frontier = uniqueCodes[~numpy.isin(uniqueCodes, seen)]
+      seen = numpy.concatenate([seen, frontier])
+
+    self.setStateCodes(seen)
+
+    # next states of all states, including terminal ones, by all actions
+    F = encoder.decodeFactorIndices(self.stateCodes)
+    self.nextState = numpy.column_stack([self.indicesOfCodes(encoder.encodeFactorIndices(transitionKernel(F, aIdx)))
+                                         for aIdx in range(aLen)]).astype(numpy.int32)
+
+  def setStateCodes(self, codes):
+    """
+    S is the list of codes, and stateCodes is the same codes in an array for vectorized lookups (see indicesOfCodes)
+    """
+    self.stateCodes = numpy.asarray(codes, dtype=numpy.int64)
+    self.codeOrder = numpy.argsort(self.stateCodes)
+    self.S = self.stateCodes.tolist()
+    self.sIndex = {s: idx for idx, s in enumerate(self.S)}
+
+  def compiledArrays(self):
+    """
+    :return: {name: array} that determine S, nextState and the reward tensor, which do not depend on psi
+    """
+    arrays = {'stateCodes': self.stateCodes, 'nextState': self.nextState}
+    if hasattr(self, 'rFuncs'):
+      rewardTensor = self.getRewardTensor()
+      arrays.update({'rewardData': rewardTensor.data, 'rewardIndices': rewardTensor.indices,
+                     'rewardIndptr': rewardTensor.indptr, 'rewardShape': numpy.array(rewardTensor.shape)})
+    return arrays
+
+  def loadCompiledArrays(self, arrays):
+    """
+    inverse of compiledArrays
+    """
+    self.setStateCodes(arrays['stateCodes'])
+    self.nextState = arrays['nextState']
+
+    if 'rewardData' in arrays:
+      self.rewardTensor = sparse.csr_matrix((arrays['rewardData'], arrays['rewardIndices'], arrays['rewardIndptr']),
+                                            shape=tuple(arrays['rewardShape']))
+
+  def indicesOfCodes(self, codes):
+    """
+    :return: the indices in S of the states encoded by codes, -1 for codes of states that are not in S
+    """
+    codes = numpy.asarray(codes, dtype=numpy.int64)
+    sortedCodes = self.stateCodes[self.codeOrder]
+
+    positions = numpy.minimum(numpy.searchsorted(sortedCodes, codes), len(sortedCodes) - 1)
+    return numpy.where(sortedCodes[positions] == codes, self.codeOrder[positions], -1)
@@ -0,0 +1,60 @@
+"""
+On-disk cache of compiled factored mdps.
+
+Experiments build the same mdp for many seeds and configurations (e.g. small grids have few different layouts).
+The arrays of a compiled mdp (states, next-state table, reward tensor, constraint masks) are saved in an .npz file named
+by a hash of the domain specification, so later runs and parallel workers load them instead of rebuilding the mdp.
+psi is not part of the key. It only weights the rows of the reward tensor, so it is set after loading.
+"""
+import hashlib
+import os
+import tempfile
+
+import numpy
+
+# change this when the saved arrays or the domain constructors change, so that old files are not loaded
+VERSION = 1
+
+
+def makeKey(spec, gamma):
+  """
+  :return: a hash of spec and gamma. The order of walls does not matter, but the order of other objects does, since it
+    determines the order of state factors, reward candidates and constraints.
+  """
+  canonical = (VERSION, spec.width, spec.height, tuple(spec.robot), tuple(map(tuple, spec.switches)),
+               tuple(sorted(map(tuple, spec.walls))), tuple(map(tuple, spec.doors)), tuple(map(tuple, spec.boxes)),
+               tuple(map(tuple, spec.carpets)), spec.horizon, repr(float(gamma)))
+  return hashlib.sha1(repr(canonical).encode('utf-8')).hexdigest()
+
+def cachePath(cacheDir, key):
+  return os.path.join(cacheDir, key + '.npz')
+
+def load(cacheDir, key):
+  """
+  :return: {name: array} saved by save(cacheDir, key, arrays), or None if it is not cached
+  """
+  path = cachePath(cacheDir, key)
+  if not os.path.exists(path):
+    return None
+
+  data = numpy.load(path)
+  try:
+    return {name: data[name] for name in data.files}
+  finally:
+    data.close()
+
+def save(cacheDir, key, arrays):
+  """
+  Write to a temporary file first, so parallel workers never load a partially written file.
+  """
+  if not os.path.exists(cacheDir):
+    try:
+      os.makedirs(cacheDir)
+    except OSError:
+      # created by another worker
+      pass
+
+  (fd, tempPath) = tempfile.mkstemp(dir=cacheDir, suffix='.tmp')
+  with os.fdopen(fd, 'wb') as f:
+    numpy.savez(f, **arrays)
+  os.rename(tempPath, cachePath(cacheDir, key))
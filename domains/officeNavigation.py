@@ -1,6 +1,11 @@
+from __future__ import print_function
+
 import random
 
-import domainConstructors
+import numpy
+
+from domains import domainConstructors
+from domains import mdpCache
 
 # constants for objects in the environment
 import util
@@ -48,6 +53,20 @@ class Spec():
     
     self.horizon = horizon
 
+  def gridLayers(self):
+    """
+    The grid as boolean masks of shape (width, height), one for each type of objects.
+    For example, layers['walls'][x, y] is True if there is a wall at (x, y).
+    Boxes are at their initial locations.
+    """
+    layers = {}
+    for name, locs in [('walls', self.walls), ('doors', self.doors), ('boxes', self.boxes),
+                       ('carpets', self.carpets), ('switches', self.switches)]:
+      layers[name] = numpy.zeros((self.width, self.height), dtype=bool)
+      for loc in locs:
+        layers[name][loc] = True
+    return layers
+
 
 def toyWorldConstructor(map, horizon=None):
   """
@@ -213,32 +232,33 @@ def parameterizedSokobanWorld(size, numOfBoxes):
 def plotDomain(spec):
   # check whether the world looks as expected
   for y in range(spec.height):
-    print '%3d' % y,
+    print('%3d' % y, end=' ')
     for x in range(spec.width):
       if (x, y) in spec.walls:
-        print '[ W]',
+        print('[ W]', end=' ')
       elif (x, y) in spec.boxes:
-        print '[ B]',
+        print('[ B]', end=' ')
       elif (x, y) in spec.switches:
-        print '[S%1d]' % spec.switches.index((x, y)),
+        print('[S%1d]' % spec.switches.index((x, y)), end=' ')
       elif (x, y) == spec.robot:
-        print '[ R]',
+        print('[ R]', end=' ')
       elif spec.carpets.count((x, y)) == 1:
-        print '[C%1d]' % spec.carpets.index((x, y)),
+        print('[C%1d]' % spec.carpets.index((x, y)), end=' ')
       elif spec.carpets.count((x, y)) > 1:
-        print '[%2d*' % spec.carpets.index((x, y)),
+        print('[%2d*' % spec.carpets.index((x, y)), end=' ')
       else:
-        print '[  ]',
-    print
-  print '  ',
+        print('[  ]', end=' ')
+    print()
+  print('  ', end=' ')
   for x in range(spec.width):
-    print '%4d' % x,
-  print
+    print('%4d' % x, end=' ')
+  print()
 
-def officeNavigationTask(spec, rewardProbs, gamma=.9):
+def officeNavigationTask(spec, rewardProbs, gamma=.9, cacheDir=None):
   """
   spec: specification of the factored mdp
   gamma: discounting factor
+  cacheDir: directory of compiled mdps (see domains.mdpCache). None to always build the mdp from scratch
   """
   # robot's location
   locIndex = 0
@@ -246,17 +266,17 @@ def officeNavigationTask(spec, rewardProbs, gamma=.9):
   # door indices
   dIndexStart = locIndex + 1
   dSize = len(spec.doors)
-  dIndices = range(dIndexStart, dIndexStart + dSize)
+  dIndices = list(range(dIndexStart, dIndexStart + dSize))
 
   # box indices
   bIndexStart = dIndexStart + dSize
   bSize = len(spec.boxes)
-  bIndices = range(bIndexStart, bIndexStart + bSize)
+  bIndices = list(range(bIndexStart, bIndexStart + bSize))
 
   # switch indices
   sIndexStart = bIndexStart + bSize
   sSize = len(spec.switches)
-  sIndices = range(sIndexStart, sIndexStart + sSize)
+  sIndices = list(range(sIndexStart, sIndexStart + sSize))
 
   # time index (may or may not be used)
   # time is needed when there are horizon-dependent constraints
@@ -350,7 +370,7 @@ def officeNavigationTask(spec, rewardProbs, gamma=.9):
   sSets = [allVisitableLocations] +\
           [[CLOSED, OPEN] for _ in spec.doors] +\
           [allVisitableLocations for _ in spec.boxes] +\
-          [[OFF, ON]] +\
+          [[OFF, ON] for _ in spec.switches] +\
           ([range(spec.horizon + 1)] if spec.horizon != None else [])
 
   # the transition function is also factored
@@ -361,6 +381,78 @@ def officeNavigationTask(spec, rewardProbs, gamma=.9):
           [switchOpGen(i, spec.switches[i - sIndexStart]) for i in sIndices] +\
           ([timeElapse] if spec.horizon != None else [])
 
+  """
+  vectorized versions of the factored transition functions above
+  they work on F, where F[i, j] is the index of the value of the j-th factor of the i-th state in sSets[j]
+  """
+  layers = spec.gridLayers()
+  # coordinates of allVisitableLocations, which are in the same order as the nonzero elements of the mask
+  locXs, locYs = numpy.nonzero(~layers['walls'])
+  # locIndexOf[x, y] is the index of (x, y) in allVisitableLocations, -1 for walls
+  locIndexOf = numpy.full((spec.width, spec.height), -1, dtype=int)
+  locIndexOf[locXs, locYs] = range(len(allVisitableLocations))
+
+  closedIdx = [CLOSED, OPEN].index(CLOSED)
+  offIdx = [OFF, ON].index(OFF)
+
+  def moveLocs(locs, a):
+    """
+    :return: indices of the locations after moving locs by a, -1 if they are out of borders or in walls
+    """
+    xs = locXs[locs] + a[0]
+    ys = locYs[locs] + a[1]
+    inGrid = (xs >= 0) & (xs < spec.width) & (ys >= 0) & (ys < spec.height)
+    return numpy.where(inGrid, locIndexOf[numpy.clip(xs, 0, spec.width - 1), numpy.clip(ys, 0, spec.height - 1)], -1)
+
+  def transitionKernel(F, aIdx):
+    a = aSets[aIdx]
+    Fp = F.copy()
+    loc = F[:, locIndex]
+
+    if a in directionalActs:
+      sp = moveLocs(loc, a)
+      blocked = sp < 0
+      for idx in dIndices:
+        door = spec.doors[idx - dIndexStart]
+        blocked |= (F[:, idx] == closedIdx) & (sp == locIndexOf[door])
+
+      # boxP is where each box would be pushed to, -1 if it is not movable
+      boxPs = {}
+      for idx in bIndices:
+        boxP = moveLocs(F[:, idx], a)
+        for bIdx in bIndices:
+          boxP[boxP == F[:, bIdx]] = -1
+        boxPs[idx] = boxP
+        blocked |= (sp == F[:, idx]) & (boxP < 0)
+
+      newLoc = numpy.where(blocked, loc, sp)
+      Fp[:, locIndex] = newLoc
+      for idx in bIndices:
+        pushed = (newLoc == F[:, idx]) & (boxPs[idx] >= 0)
+        Fp[:, idx] = numpy.where(pushed, boxPs[idx], F[:, idx])
+    elif a in [OPENDOOR, CLOSEDOOR]:
+      for idx in dIndices:
+        door = spec.doors[idx - dIndexStart]
+        atDoor = numpy.isin(loc, [locIndexOf[x, door[1]] for x in [door[0] - 1, door[0]] if x >= 0])
+        doorIdx = [CLOSED, OPEN].index(CLOSED if a == CLOSEDOOR else OPEN)
+        Fp[atDoor, idx] = doorIdx
+
+    if a == TURNOFFSWITCH:
+      for idx in sIndices:
+        switch = spec.switches[idx - sIndexStart]
+        Fp[loc == locIndexOf[switch], idx] = offIdx
+
+    if spec.horizon != None:
+      # time indices are the time steps
+      Fp[:, tIndex] += 1
+
+    return Fp
+
+  if spec.horizon != None:
+    terminalKernel = lambda F: F[:, tIndex] == spec.horizon
+  else:
+    terminalKernel = lambda F: (F[:, sIndices] == offIdx).any(axis=1)
+
   s0List = [spec.robot] +\
            [CLOSED for _ in spec.doors] +\
            spec.boxes +\
@@ -368,7 +460,7 @@ def officeNavigationTask(spec, rewardProbs, gamma=.9):
            ([0] if spec.horizon != None else [])
 
   s0 = tuple(s0List)
-  print 'init state', s0
+  print('init state', s0)
 
   # terminal conditions
   if spec.horizon != None:
@@ -398,21 +490,43 @@ def officeNavigationTask(spec, rewardProbs, gamma=.9):
   # create the list of reward candidates, in the form of [(reward_func, prob)]
   rFunc = [(rewardFuncGen(sIdx), rewardProbs[sIdx - sIndexStart]) for sIdx in sIndices]
 
-  mdp = domainConstructors.DeterministicFactoredMDP(sSets, aSets, rFunc, tFunc, s0, gamma, terminal)
+  if cacheDir is not None:
+    key = mdpCache.makeKey(spec, gamma)
+    compiled = mdpCache.load(cacheDir, key)
+  else:
+    compiled = None
+
+  mdp = domainConstructors.DeterministicFactoredMDP(sSets, aSets, rFunc, tFunc, s0, gamma, terminal,
+                                                    transitionKernel=transitionKernel, terminalKernel=terminalKernel,
+                                                    compiled=compiled)
+
+  if compiled is not None:
+    consStates = domainConstructors.StateConstraints(mdp.S, compiled['consMasks'])
+    goalStates = [mdp.S[idx] for idx in numpy.nonzero(compiled['goalMask'])[0]]
+    return mdp, consStates, goalStates
 
   # implement the set of constrained states based on feature representation
   # consStates is [[states that violate the i-th constraint] for i in all constraints]
   # Note that implementation here does not distinguish free and need-to-be-reverted features
   # since we implement them both as constraints in linear programming anyway.
+  F = mdp.encoder.decodeFactorIndices(mdp.stateCodes)
 
   # carpets are locked features by default
-  carpetCons = [[s for s in mdp.S if s[locIndex] == _] for _ in spec.carpets]
+  carpetCons = [F[:, locIndex] == locIndexOf[carpet] for carpet in spec.carpets]
   # boxes are need-to-be-reverted features by default
-  boxCons = [[s for s in mdp.S if terminal(s) and s[bIdx] != s0[bIdx]] for bIdx in bIndices]
-  consStates = carpetCons + boxCons
+  boxCons = [terminalKernel(F) & (F[:, bIdx] != locIndexOf[s0[bIdx]]) for bIdx in bIndices]
+  # incidence matrix of constraints and states
+  consStates = domainConstructors.StateConstraints(mdp.S, numpy.array(carpetCons + boxCons).reshape(-1, len(mdp.S)))
 
   # goal states are that the switch needs to be turned off in the end
   #goalStates = [s for s in mdp.S for sIndex in sIndices if s[sIndex] == OFF]
   goalStates = []
 
+  if cacheDir is not None:
+    arrays = mdp.compiledArrays()
+    arrays['consMasks'] = consStates.incidence.toarray()
+    arrays['goalMask'] = numpy.zeros(len(mdp.S), dtype=bool)
+    arrays['goalMask'][[mdp.sIndex[s] for s in goalStates]] = True
+    mdpCache.save(cacheDir, key, arrays)
+
   return mdp, consStates, goalStates
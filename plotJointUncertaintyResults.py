@@ -1,3 +1,5 @@
+from __future__ import print_function
+
 import collections
 import os
 import pickle
@@ -31,11 +33,11 @@ def plot(x, y, methods, xlabel, ylabel, filename, intXAxis=False, intYAxis=False
   yMean = lambda method: [mean(y(method, xElem)) for xElem in x]
   yCI = lambda method: [standardErr(y(method, xElem)) for xElem in x]
 
-  print xlabel, 'vs', ylabel
+  print(xlabel, 'vs', ylabel)
   fig = pylab.figure()
   ax = pylab.gca()
   for method in methods:
-    print method, yMean(method), yCI(method)
+    print(method, yMean(method), yCI(method))
     ax.errorbar(xAxis, yMean(method), yCI(method), fmt=markers[method], mfc='none', label=names[method],
                 markersize=15, capsize=10,  linewidth=2)
 
@@ -61,7 +63,7 @@ def histogram(x, xlabel, filename, markZero=False):
 
   fig = pylab.figure()
 
-  pylab.hist(x, bins=map((0.2).__mul__, range(0, 6)))
+  pylab.hist(x, bins=[0.2 * _ for _ in range(0, 6)])
   # draw a vertical line that highlight the number of matches
   if markZero:
     pylab.plot((0, 0), (0, numOfMatch), marker='+', color='black', linewidth=3, markeredgewidth=2, markersize=15)
@@ -164,9 +166,9 @@ if __name__ == '__main__':
           batchDiff = [e1 - e2 for e1, e2 in zip(batchResults, comparedResults)]
 
           # print random seeds where batch is worse
-          print "batch worse than ", comparedHeuristic,
+          print("batch worse than ", comparedHeuristic, end=' ')
           diffInstances = [(_, batchDiff[_]) for _ in range(len(batchDiff)) if batchDiff[_] < 0]
-          print numOfCarpets, numOfSwitches, costOfQuery, sorted(diffInstances, key=lambda x: x[1])
+          print(numOfCarpets, numOfSwitches, costOfQuery, sorted(diffInstances, key=lambda x: x[1]))
           #print numOfCarpets, numOfSwitches, costOfQuery, [(_, batchFreqDiff[_]) for _ in range(len(batchFreqDiff)) if batchFreqDiff[_] <= 0.1]
 
           allBatchDiff += batchDiff
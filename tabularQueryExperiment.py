@@ -1,3 +1,5 @@
+from __future__ import print_function
+
 import collections
 import copy
 import getopt
@@ -8,7 +10,6 @@ import sys
 import time
 
 import numpy
-import scipy
 
 import config
 from algorithms.consQueryAgents import ConsQueryAgent, EXIST, NOTEXIST
@@ -52,7 +53,7 @@ def findInitialSafePolicy(mdp, consStates, goalStates, trueFreeFeatures, rnd, co
   from config import methods
 
   for method in methods:
-    print method
+    print(method)
     queries[method] = []
     times[method] = []
 
@@ -165,12 +166,12 @@ def findInitialSafePolicy(mdp, consStates, goalStates, trueFreeFeatures, rnd, co
     # FIXME why list?
     times[method].append(end - start)
 
-  print 'queries', queries
-  print 'times', times
-  print 'safe policy', answer
+  print('queries', queries)
+  print('times', times)
+  print('safe policy', answer)
   # print 'safe policy value', valuesOfSafePis
 
-  if 'oracle' in queries.keys() and len(queries['oracle']) == 0:
+  if 'oracle' in queries and len(queries['oracle']) == 0:
     # do not record cases where it is impossible to find a safe policy (because of the transition dynamics)
     return
 
@@ -227,13 +228,13 @@ def improveSafePolicyMMR(mdp, consStates, k, rnd):
     # some alg actually does not need dom pis
     runTime = end - start + (0 if method in ['random', 'nq'] else domPiTime)
 
-    print method, q
+    print(method, q)
 
     mrk, advPi = agent.findMRAdvPi(q, relFeats, domPis, k, consHuman=True)
 
     regret = agent.findRegret(q, violableCons)
 
-    print mrk, regret, runTime
+    print(mrk, regret, runTime)
 
 def jointUncertaintyQuery(mdp, method, consStates, consProbs, trueRewardIdx, trueFreeFeatures, rnd, costOfQuery):
   """
@@ -268,7 +269,7 @@ def jointUncertaintyQuery(mdp, method, consStates, consProbs, trueRewardIdx, tru
     else:
       queriesAsked.append(query)
       (qType, qContent) = query
-      if config.VERBOSE: print 'QUERY POSED', query
+      if config.VERBOSE: print('QUERY POSED', query)
 
       if qType == 'F':
         # a feature query
@@ -329,16 +330,16 @@ def experiment(mdp, consStates, goalStates, k, rnd, consProbs, costOfQuery=0.0):
   for trueRewardFuncIdx in range(numOfRewards):
     for trueFreeFeatures in powerset(range(numOfCons)):
       if config.VERBOSE:
-        print
-        print 'reward', trueRewardFuncIdx
-        print 'free features', trueFreeFeatures
+        print()
+        print('reward', trueRewardFuncIdx)
+        print('free features', trueFreeFeatures)
 
       thisResult = collections.defaultdict(int)
 
       for method in methods:
         if config.VERBOSE:
-          print
-          print 'method', method
+          print()
+          print('method', method)
 
         # under joint uncertainty:
         thisResult[method] = jointUncertaintyQuery(mdp, method, consStates, consProbs, trueRewardFuncIdx, trueFreeFeatures, rnd, costOfQuery)
@@ -355,19 +356,19 @@ def experiment(mdp, consStates, goalStates, k, rnd, consProbs, costOfQuery=0.0):
           batch_results[method][key] += weight * thisResult[method][key]
 
         # print this info for debugging
-        if config.VERBOSE: print thisResult[method]
+        if config.VERBOSE: print(thisResult[method])
 
       for comparedMethod in ['myopic', 'dompi']:
         if thisResult['batch']['obj'] < thisResult[comparedMethod]['obj']:
-          print trueRewardFuncIdx, trueFreeFeatures, {method: (thisResult[method]['obj'], thisResult[method]['queriesAsked']) for method in ['batch', comparedMethod]}
+          print(trueRewardFuncIdx, trueFreeFeatures, {method: (thisResult[method]['obj'], thisResult[method]['queriesAsked']) for method in ['batch', comparedMethod]})
 
   return batch_results, domPiNum
 
 def setRandomSeed(rnd):
-  print 'random seed', rnd
+  print('random seed', rnd)
   random.seed(rnd)
+  # scipy uses the random state of numpy (scipy.random was an alias of numpy.random, removed in new versions)
   numpy.random.seed(rnd)
-  scipy.random.seed(rnd)
 
 if __name__ == '__main__':
   # default values
@@ -426,19 +427,20 @@ if __name__ == '__main__':
         # uniform prior over rewards
         #rewardProbs = [1.0 / numOfSwitches] * numOfSwitches
         # random prior over rewards (add 0.1 to reduce variance a little bit)
-        rewardProbs = normalize([random.random() for _ in range(numOfSwitches)]); print 'psi', rewardProbs
-        print 'rewardProbs', rewardProbs
+        rewardProbs = normalize([random.random() for _ in range(numOfSwitches)]); print('psi', rewardProbs)
+        print('rewardProbs', rewardProbs)
 
-        mdp, consStates, goalStates = officeNavigationTask(spec, rewardProbs=rewardProbs, gamma=0.99)
+        mdp, consStates, goalStates = officeNavigationTask(spec, rewardProbs=rewardProbs, gamma=0.99,
+                                                           cacheDir=config.MDP_CACHE_DIR)
 
         numOfCons = len(consStates)
         consProbs = [random.random() for _ in range(numOfCons)]
         #consProbs = [0.5 for _ in range(numOfCons)]
-        print 'consProbs', zip(range(numOfCons), consProbs)
+        print('consProbs', list(zip(range(numOfCons), consProbs)))
 
         domPiNum = None
         for costOfQuery in costsOfQuery:
-          print '# of carpets:', numOfCarpets, '# of switches:', numOfSwitches, 'query cost', costOfQuery
+          print('# of carpets:', numOfCarpets, '# of switches:', numOfSwitches, 'query cost', costOfQuery)
 
           result, domPiNum = experiment(mdp, consStates, goalStates, k, rnd, consProbs, costOfQuery=costOfQuery)
           results[(numOfCarpets, numOfSwitches, costOfQuery)] = result
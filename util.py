@@ -19,7 +19,7 @@ def normalize(vec):
   sumOfMass = sum(vec)
   # if we have a zero vector, simply return it
   if sumOfMass == 0: return vec
-  else: return map(lambda _: 1.0 * _ / sumOfMass, vec)
+  else: return [1.0 * _ / sumOfMass for _ in vec]
 
 def standardErr(data):
   return std(data) / sqrt(len(data))
@@ -59,7 +59,7 @@ def computePosteriorBelief(psi, consistentRewards=None, inconsistentRewards=None
     psi = copy.copy(psi)
 
     if inconsistentRewards is not None:
-      allRewardIdx = range(len(psi))
+      allRewardIdx = list(range(len(psi)))
       consistentRewards = set(allRewardIdx) - set(inconsistentRewards)
     assert consistentRewards is not None
 
@@ -87,6 +87,9 @@ def checkPolicyConsistency(states, a, b):
 
   return 1.0 * consistentPolices / len(states)
 
-def printOccSA(x):
-  nonZeroSAOcc = filter(lambda _: _[1] > 0, x.items())
+def printOccSA(x, decodeState=lambda s: s):
+  """
+  :param decodeState: maps states to what to print, e.g. DeterministicFactoredMDP.decodeState for factored states
+  """
+  nonZeroSAOcc = [((decodeState(s), a), occ) for ((s, a), occ) in x.items() if occ > 0]
   pprint.pprint(sorted(nonZeroSAOcc, key=lambda _: _[1], reverse=True))